@@ -0,0 +1,465 @@
+'''
+Regression tests for the vectorized key data, activity, sleep and sleep event cleanup. Each one compares the clean_*
+functions of whoop_login with the original apply/lambda cleanup, kept here as an oracle, on synthetic api data
+from whoop_benchmark. The rest test the pull window planning, retries and throttling, the cache, the checkpoint,
+the store, the rollups and incremental syncs (against the stand-in api of whoop_benchmark).
+
+    python -m pytest -q
+'''
+
+import json
+import threading
+from datetime import date, datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from whoop_benchmark import synthetic_cycle, synthetic_sleep, SPORTS, start_server
+import whoop_download
+from whoop_download import whoop_login, whoop_store, whoop_throttle, whoop_api_error, whoop_cache
+
+
+SPORT_DICT={sport['id']:sport['name'] for sport in SPORTS}
+## nap lists for the first days of the fixture - none, one, two and three naps, and naps without a qualityDuration
+NAPS=[[],
+      [{'qualityDuration':1200000}],
+      [{'qualityDuration':600000},{'qualityDuration':1800000}],
+      [{'qualityDuration':900000},{'qualityDuration':None},{'qualityDuration':2400000}],
+      [{'qualityDuration':None},{'qualityDuration':None}]]
+
+
+@pytest.fixture
+def client():
+    return whoop_login()
+
+
+@pytest.fixture
+def cycles():
+    '''
+    Synthetic cycles for 6 weeks, with the nap lists of NAPS on the first days
+    '''
+    days=[date(2021,1,4)+timedelta(days=d) for d in range(42)]
+    cycles=[synthetic_cycle(day) for day in days]
+    for cycle, naps in zip(cycles,NAPS):
+        cycle['sleep']['naps']=naps
+    return cycles
+
+
+@pytest.fixture
+def sleeps(cycles):
+    return [synthetic_sleep(cycle['sleep']['id']) for cycle in cycles]
+
+
+def baseline_keydata(data):
+    '''
+    The original key data cleanup
+    '''
+    data['days']=data['days'].map(lambda d: d[0])
+    data.rename(columns={"days":'day'},inplace=True)
+    sleep_cols=['qualityDuration','needBreakdown.baseline','needBreakdown.debt','needBreakdown.naps',
+                'needBreakdown.strain','needBreakdown.total']
+    for sleep_col in sleep_cols:
+        data['sleep.' + sleep_col]=data['sleep.' + sleep_col].astype(float).apply(lambda x: np.nan if np.isnan(x) else x/60000)
+    data['nap_duration']=data['sleep.naps'].apply(lambda x: x[0]['qualityDuration']/60000 if len(x)==1 else(
+                                        sum([y['qualityDuration'] for y in x if y['qualityDuration'] is not None])/60000 if len(x)>1 else 0))
+    data.drop(['sleep.naps'],axis=1,inplace=True)
+    data.drop_duplicates(subset=['day','sleep.id'],inplace=True)
+    return data
+
+
+def baseline_activities(data,sport_dict):
+    '''
+    The original activity cleanup
+    '''
+    act_data=pd.json_normalize(data[data['strain.workouts'].apply(len)>0]['strain.workouts'].apply(lambda x: x[0]))
+    act_data[['during.upper','during.lower']]=act_data[['during.upper','during.lower']].apply(pd.to_datetime)
+    act_data['total_minutes']=act_data.apply(lambda x: (x['during.upper']-x['during.lower']).total_seconds()/60.0,axis=1)
+    for z in range(0,6):
+        act_data['zone{}_minutes'.format(z+1)]=act_data['zones'].apply(lambda x: x[z]/60000.)
+    act_data['sport_name']=act_data.sportId.apply(lambda x: sport_dict[x])
+    act_data['day']=act_data['during.lower'].dt.strftime('%Y-%m-%d')
+    act_data.drop(['zones','during.bounds'],axis=1,inplace=True)
+    act_data.drop_duplicates(inplace=True)
+    return act_data
+
+
+def baseline_sleep(sleep):
+    '''
+    The original sleep cleanup
+    '''
+    sleep_update=['qualityDuration','latency','debtPre','debtPost','needFromStrain','sleepNeed',
+                  'habitualSleepNeed','timeInBed','lightSleepDuration','slowWaveSleepDuration',
+                  'remSleepDuration','wakeDuration','arousalTime','noDataDuration','creditFromNaps',
+                  'projectedSleep']
+    for col in sleep_update:
+        sleep[col]=sleep[col].astype(float).apply(lambda x: np.nan if np.isnan(x) else x/60000)
+    sleep.drop(['during.bounds','events'],axis=1,inplace=True)
+    return sleep
+
+
+def baseline_sleep_events(events):
+    '''
+    The original sleep event cleanup
+    '''
+    events['during.lower']=pd.to_datetime(events['during.lower'])
+    events['during.upper']=pd.to_datetime(events['during.upper'])
+    events.drop(['during.bounds'],axis=1,inplace=True)
+    events['total_minutes']=events.apply(lambda x: (x['during.upper']-x['during.lower']).total_seconds()/60.0,axis=1)
+    return events
+
+
+def test_clean_keydata(client,cycles):
+    expected=client.apply_schema('keydata',baseline_keydata(pd.json_normalize(cycles)))
+    pd.testing.assert_frame_equal(client.clean_keydata(pd.json_normalize(cycles)),expected)
+
+
+def test_clean_keydata_nap_duration(client,cycles):
+    ## 0, 1, 2 and 3 naps (one of them without a qualityDuration), then two naps without one
+    nap_duration=client.clean_keydata(pd.json_normalize(cycles))['nap_duration'].tolist()[:len(NAPS)]
+    assert nap_duration==pytest.approx([0,20,40,55,0])
+
+
+def test_clean_keydata_single_missing_nap(client,cycles):
+    ## the original cleanup failed on a single nap without a qualityDuration, it now counts as no nap time
+    cycles[1]['sleep']['naps']=[{'qualityDuration':None}]
+    assert client.clean_keydata(pd.json_normalize(cycles))['nap_duration'].iloc[1]==0
+
+
+def test_clean_activities(client,cycles):
+    data=pd.json_normalize(cycles)
+    ## json_normalize keeps the index of the workouts series on newer pandas versions, only the rows are compared
+    expected=client.apply_schema('activities',baseline_activities(data.copy(),SPORT_DICT)).reset_index(drop=True)
+    pd.testing.assert_frame_equal(client.clean_activities(data[['strain.workouts']],SPORT_DICT),expected)
+
+
+def test_clean_sleep(client,sleeps):
+    expected=client.apply_schema('sleep',baseline_sleep(pd.json_normalize(sleeps)))
+    pd.testing.assert_frame_equal(client.clean_sleep(pd.json_normalize(sleeps)),expected)
+
+
+def test_clean_sleep_events(client,sleeps):
+    expected=client.apply_schema('sleep_events',baseline_sleep_events(client.normalize_sleep_events(sleeps)))
+    pd.testing.assert_frame_equal(client.clean_sleep_events(client.normalize_sleep_events(sleeps)),expected)
+
+
+def test_weekly_rollups_weight_hr_avg(client,monkeypatch):
+    ## a partial day of 200 measurements counts for less than a full day of 14400
+    daily=pd.DataFrame({'day':pd.to_datetime(['2021-01-04','2021-01-05']),'hr_avg':[100.,60.],'hr_samples':[14400,200]})
+    for col in client.weekly_rollup:
+        if col not in daily:
+            daily[col]=np.nan
+    monkeypatch.setattr(client,'get_daily_rollups',lambda start,end: daily)
+    weekly=client.get_weekly_rollups()
+    assert weekly['hr_avg'].iloc[0]==pytest.approx((100*14400+60*200)/14600)
+    assert weekly['hr_samples'].iloc[0]==14600
+
+
+def test_store_load_empty_rollups(client,tmp_path):
+    ## days without heart rate are covered by the store without creating the rollup table
+    store=client.store=whoop_store(str(tmp_path/'store.sqlite'))
+    empty=client.hr_frame(np.array([],dtype=np.int64),np.array([],dtype=np.uint8))
+    client.save_to_store('hr_daily',client.rollup_hr(empty),'2015-01-01','2015-01-20')
+    assert store.covers('hr_daily',client.whoop_id,'2015-01-01','2015-01-20')
+    rollups=client.load_from_store('hr_daily','2015-01-01','2015-01-20')
+    assert len(rollups)==0 and list(rollups.columns)==list(client.schemas['hr_daily'])
+
+
+def test_checkpoint_keeps_closed_windows(client,monkeypatch):
+    ## an open window can still change, so it's pulled again rather than resumed from the checkpoint
+    monkeypatch.setattr(client,'request_content',lambda url: b'[]')
+    closed='{}/users/1/cycles?end=2021-01-10T23:59:59.999Z&start=2021-01-04T00:00:00.000Z'.format(client.api_url)
+    still_open='{}/users/1/cycles?end=2999-01-10T23:59:59.999Z&start=2999-01-04T00:00:00.000Z'.format(client.api_url)
+    client.pull_content(closed,checkpoint=True)
+    client.pull_content(still_open,checkpoint=True)
+    assert list(client.checkpoint)==[closed]
+
+
+def test_stored_activities_follow_cycle_day(client,cycles,tmp_path):
+    ## an evening workout that starts on the next UTC day belongs to the timeframe of its cycle, pulled or stored
+    cycles[0]['strain']['workouts']=[{'id':1,'during':{'bounds':'[)','lower':'2021-01-05T02:00:00.000Z','upper':'2021-01-05T03:00:00.000Z'},
+                                      'sportId':0,'zones':[0]*6,'strain':10.0,'averageHeartRate':120,'maxHeartRate':170,
+                                      'kilojoules':1000.0}]
+    data=client.clean_keydata(pd.json_normalize(cycles))
+    activities=client.clean_activities(data[['day','strain.workouts']],SPORT_DICT)
+    assert activities.loc[activities.id==1,'cycle_day'].iloc[0]==pd.Timestamp('2021-01-04')
+
+    client.store=whoop_store(str(tmp_path/'store.sqlite'))
+    client.save_to_store('activities',activities,'2021-01-04','2021-02-14')
+    pulled=activities[(activities.cycle_day>='2021-01-04')&(activities.cycle_day<='2021-01-04')].reset_index(drop=True)
+    stored=client.load_from_store('activities','2021-01-04','2021-01-04')
+    assert stored.id.tolist()==pulled.id.tolist()==[1]
+
+
+def window_times(windows):
+    return [[pd.Timestamp(start),pd.Timestamp(end)] for start, end in windows]
+
+
+def test_week_windows_contiguous(client):
+    windows=client.week_windows(datetime(2021,1,4,15,30),datetime(2021,3,2,8))
+    times=window_times(windows)
+    assert windows[0][0]=='2021-01-04T00:00:00.000Z'
+    ## each window ends a millisecond before the next one starts, so no day is pulled twice or skipped
+    for (start, end), (next_start, next_end) in zip(times,times[1:]):
+        assert end+pd.Timedelta(milliseconds=1)==next_start
+        assert next_start-start==pd.Timedelta(days=7)
+    ## the last window is clipped to the end of the day of until
+    assert windows[-1][1]=='2021-03-02T23:59:59.999Z'
+
+
+def test_week_windows_days(client):
+    windows=client.week_windows(datetime(2021,1,1),datetime(2021,1,25),days=10)
+    assert windows==[['2021-01-01T00:00:00.000Z','2021-01-10T23:59:59.999Z'],
+                     ['2021-01-11T00:00:00.000Z','2021-01-20T23:59:59.999Z'],
+                     ['2021-01-21T00:00:00.000Z','2021-01-25T23:59:59.999Z']]
+
+
+def test_week_windows_membership_start(client):
+    ## windows never start before the first day of the membership
+    client.start_datetime='2021-01-06T18:20:00.000Z'
+    windows=client.week_windows(datetime(2021,1,1),datetime(2021,1,20))
+    assert windows[0]==['2021-01-06T00:00:00.000Z','2021-01-12T23:59:59.999Z']
+    assert windows[-1]==['2021-01-20T00:00:00.000Z','2021-01-20T23:59:59.999Z']
+
+
+def test_week_windows_utc(client):
+    ## naive datetimes are taken as UTC, others are converted to UTC days
+    naive=client.week_windows(datetime(2021,1,4,12),datetime(2021,1,17,12))
+    assert client.week_windows(datetime(2021,1,4,12,tzinfo=timezone.utc),datetime(2021,1,17,12,tzinfo=timezone.utc))==naive
+    eastern=timezone(timedelta(hours=-5))
+    shifted=client.week_windows(datetime(2021,1,3,22,tzinfo=eastern),datetime(2021,1,17,20,tzinfo=eastern))
+    assert shifted[0][0]=='2021-01-04T00:00:00.000Z' and shifted[-1][1]=='2021-01-18T23:59:59.999Z'
+
+
+def baseline_hr(values):
+    '''
+    The original heart rate output, a list of [date, time, hr] lists
+    '''
+    return [[datetime.utcfromtimestamp(h['time']/1e3).date(),datetime.utcfromtimestamp(h['time']/1e3).time(),h['data']]
+            for h in values]
+
+
+def test_hr_legacy(client):
+    values=[{'time':1609459200000+6000*i,'data':55+i%70} for i in range(30000)]
+    hr_df=client.hr_frame(*client.decode_hr(values))
+    assert client.hr_legacy(hr_df)==baseline_hr(values)
+    expected=pd.DataFrame(baseline_hr(values))
+    expected.columns=['date','time','hr']
+    pd.testing.assert_frame_equal(client.hr_legacy(hr_df,df=True),expected)
+
+
+def test_rollups_before_membership(client):
+    ## a timeframe before the membership has no windows to pull, so the rollups come back empty
+    client.auth_code='bearer test'
+    client.start_datetime='2021-01-06T18:20:00.000Z'
+    assert list(client.clean_keydata(pd.json_normalize([])).columns)==list(client.schemas['keydata'])+['strain.workouts']
+    daily=client.get_daily_rollups('2015-01-01','2015-01-20')
+    assert len(daily)==0 and 'hr_avg' in daily and 'strain.score' in daily
+    assert len(client.get_weekly_rollups('2015-01-01','2015-01-20'))==0
+
+
+def test_sleep_payloads_released(client,sleeps):
+    ## the raw details are kept until both the sleep and sleep events data are built from them
+    client.sleep_payloads={sleep['activityId']:sleep for sleep in sleeps}
+    ids=list(client.sleep_payloads)
+    client.release_sleeps('sleep',ids)
+    assert len(client.sleep_payloads)==len(ids)
+    client.release_sleeps('sleep_events',ids[:10])
+    assert sorted(client.sleep_payloads)==sorted(ids[10:])
+    client.release_sleeps('sleep_events',ids[10:])
+    assert client.sleep_payloads=={} and client.sleeps_built=={'sleep':set(),'sleep_events':set()}
+
+
+class scripted_handler(BaseHTTPRequestHandler):
+    '''Answers each request with the next (status, headers, body) of the server's script, repeating the last one'''
+
+    protocol_version='HTTP/1.1'
+
+    def log_message(self,*args):
+        pass
+
+    def do_GET(self):
+        script=self.server.script
+        status,headers,body=script[min(self.server.requests,len(script)-1)]
+        self.server.requests+=1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name,value)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    '''
+    A local api answering with a script of responses, and a list of the waits between retries instead of sleeping
+    '''
+    server=ThreadingHTTPServer(('127.0.0.1',0),scripted_handler)
+    server.daemon_threads=True
+    server.script=[(200,{},b'[]')]
+    server.requests=0
+    server.url='http://127.0.0.1:{}'.format(server.server_address[1])
+    server.waits=[]
+    monkeypatch.setattr(whoop_download.time,'sleep',server.waits.append)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_retry_after_then_success(api):
+    api.script=[(429,{'Retry-After':'7'},b''),(200,{},b'[{"id":1}]')]
+    client=whoop_login(api_url=api.url,max_workers=8)
+    assert client.pull_api(api.url + '/sports')==[{'id':1}]
+    ## the wait the api asked for is used, and the throttle halves the requests in flight
+    assert api.requests==2 and api.waits==[7.0]
+    assert client.throttle.limit==4
+
+
+def test_server_errors_exhaust_retries(api):
+    api.script=[(503,{},b'')]
+    client=whoop_login(api_url=api.url,max_retries=2,backoff=1.0,max_backoff=1.5)
+    with pytest.raises(whoop_api_error) as e:
+        client.pull_api(api.url + '/sports')
+    assert e.value.status==503 and api.requests==3
+    ## exponential backoff with jitter, capped at max_backoff
+    assert len(api.waits)==2 and 0<=api.waits[0]<=1 and 0<=api.waits[1]<=1.5
+
+
+def test_rejected_pull_raises_immediately(api):
+    api.script=[(401,{},b''),(200,{},b'[]')]
+    client=whoop_login(api_url=api.url)
+    with pytest.raises(whoop_api_error) as e:
+        client.pull_api(api.url + '/sports')
+    assert e.value.status==401 and api.requests==1 and api.waits==[]
+
+
+def test_throttle_halves_and_grows_back():
+    throttle=whoop_throttle(8)
+    throttle.throttled()
+    throttle.throttled()
+    assert throttle.limit==2
+    ## the limit grows by one after each run of as many successes as the limit
+    for n in range(2):
+        throttle.succeeded()
+    assert throttle.limit==3
+    for n in range(3+4+5+6):
+        throttle.succeeded()
+    assert throttle.limit==7
+    for n in range(50):
+        throttle.succeeded()
+    assert throttle.limit==8
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    A clock for the cache that only moves when it's told to
+    '''
+    now=[1000.0]
+    monkeypatch.setattr(whoop_download.time,'time',lambda: now[0])
+    return now
+
+
+def test_cache_expiry(tmp_path,clock):
+    cache=whoop_cache(str(tmp_path/'cache.sqlite'),ttl=60)
+    cache.set('closed',b'week',closed=True)
+    cache.set('open',b'today')
+    clock[0]+=59
+    assert cache.get('open')==b'today'
+    ## open windows expire after ttl, closed ones never do
+    clock[0]+=2
+    assert cache.get('open') is None
+    clock[0]+=365*86400
+    assert cache.get('closed')==b'week'
+
+
+def test_cache_eviction(tmp_path,clock):
+    ## random bytes don't compress, so each response takes up about 1000 bytes
+    content={url:np.random.default_rng(n).bytes(1000) for n, url in enumerate('abcd')}
+    cache=whoop_cache(str(tmp_path/'cache.sqlite'),max_bytes=3100)
+    for url in 'abc':
+        clock[0]+=1
+        cache.set(url,content[url],closed=True)
+    ## reading a keeps it, so b is now the least recently used
+    clock[0]+=1
+    assert cache.get('a')==content['a']
+    clock[0]+=1
+    cache.set('d',content['d'],closed=True)
+    assert [cache.get(url) is not None for url in 'abcd']==[True,False,True,True]
+
+    cache.clear()
+    assert all(cache.get(url) is None for url in 'abcd')
+
+
+@pytest.fixture(scope='module')
+def standin():
+    '''
+    The stand-in api of whoop_benchmark, serving about 5 weeks of synthetic data
+    '''
+    process,api_url,stats=start_server(years=0.1)
+    yield api_url
+    process.terminate()
+
+
+def standin_login(standin,tmp_path):
+    user_ini=tmp_path/'whoop.ini'
+    user_ini.write_text('[whoop]\nusername=test\npassword=test\n')
+    client=whoop_login(api_url=standin,max_workers=4)
+    client.get_authorization(str(user_ini))
+    return client
+
+
+def test_sync_keydata(standin,tmp_path):
+    sync_dir=str(tmp_path/'sync')
+    client=standin_login(standin,tmp_path)
+    first=client.sync_keydata(sync_dir)
+    weeks=client.stats['requests']
+    state_path=tmp_path/'sync'/str(client.whoop_id)/'state.json'
+    assert json.loads(state_path.read_text())['keydata_day']==first['day'].max().strftime('%Y-%m-%d')
+
+    ## a stale value on the last day is replaced by the newer pull
+    stored=pd.read_pickle(tmp_path/'sync'/str(client.whoop_id)/'keydata.pkl')
+    stored.loc[stored.index[-1],'strain.score']=-1
+    stored.to_pickle(tmp_path/'sync'/str(client.whoop_id)/'keydata.pkl')
+
+    requests=client.stats['requests']
+    synced=client.sync_keydata(sync_dir)
+    ## only the last day and the 2 days of overlap before it are pulled, in a single window
+    assert client.stats['requests']-requests==1
+    assert client.sync_rows['keydata']==3
+    assert synced['day'].is_unique and len(synced)==len(first)
+    pd.testing.assert_series_equal(synced['strain.score'],first['strain.score'])
+
+    ## the sync state is kept per whoop_id, so another account starts with a full pull
+    other=standin_login(standin,tmp_path)
+    other.whoop_id=client.whoop_id + 1
+    other.sync_keydata(sync_dir)
+    assert other.stats['requests']==weeks
+
+
+def test_sync_hr(standin,tmp_path):
+    sync_dir=str(tmp_path/'sync')
+    client=standin_login(standin,tmp_path)
+    first=client.sync_hr(sync_dir)
+    requests=client.stats['requests']
+    synced=client.sync_hr(sync_dir)
+    ## only the window holding the last measurement (minus the overlap) is pulled again
+    assert client.stats['requests']-requests==1
+    assert synced.index.is_unique and synced.index.is_monotonic_increasing
+    assert len(synced)>=len(first) and client.sync_rows['hr']<len(first)
+
+
+def test_pool_follows_max_workers():
+    def maxsize(client):
+        return client.session.get_adapter('https://api-7.whoop.com').poolmanager.connection_pool_kw['maxsize']
+    client=whoop_login(max_workers=4)
+    assert maxsize(client)==10
+    client.max_workers=32
+    assert maxsize(client)==32 and client.throttle.max_limit==32
+    ## a pool_size that was given is kept
+    fixed=whoop_login(max_workers=4,pool_size=12)
+    fixed.max_workers=32
+    assert maxsize(fixed)==12
@@ -0,0 +1,265 @@
+'''
+Benchmarks the whoop_login get_* functions against a local stand-in for the WHOOP api, so the downloader can be
+timed without hitting api-7.whoop.com. The stand-in server serves synthetic cycles, sleeps, heart rate and sports
+for a membership of any length, with an optional delay on every request to mimic network latency.
+
+Example, comparing the serial pull with 8 requests in flight over 2 years of data:
+
+    python whoop_benchmark.py --years 2 --latency 0.05 --workers 1 8
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from whoop_download import whoop_login
+
+
+SLEEP_FIELDS=['qualityDuration','latency','debtPre','debtPost','needFromStrain','sleepNeed','habitualSleepNeed',
+              'timeInBed','lightSleepDuration','slowWaveSleepDuration','remSleepDuration','wakeDuration',
+              'arousalTime','noDataDuration','creditFromNaps','projectedSleep']
+SPORTS=[{'id':0,'name':'Running'},{'id':1,'name':'Cycling'},{'id':44,'name':'Yoga'},{'id':45,'name':'Weightlifting'}]
+EVENT_TYPES=['LATENCY','LIGHT','SWS','REM','WAKE','LIGHT','SWS','REM','DISTURBANCES','LIGHT','REM']
+
+
+def iso(d):
+    return d.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def during(lower,upper):
+    return {'bounds':'[)','lower':iso(lower),'upper':iso(upper)}
+
+
+def synthetic_cycle(day):
+    '''
+    Returns a synthetic cycle for a day, seeded by the day so every pull of the same day is identical
+    '''
+    r=random.Random(day.toordinal())
+    lower=datetime(day.year,day.month,day.day,6,tzinfo=timezone.utc)
+    sleep_id=day.toordinal()*10
+    naps=[{'qualityDuration':r.randint(600000,2400000)} for n in range(r.choice([0,0,0,1,2]))]
+    workouts=[]
+    for w in range(r.choice([0,1,1,2])):
+        start=lower+timedelta(hours=3+w*5,minutes=r.randint(0,59))
+        workouts.append({'id':sleep_id+w+1,'during':during(start,start+timedelta(minutes=r.randint(20,120))),
+                         'sportId':r.choice(SPORTS)['id'],'zones':[r.randint(0,900000) for z in range(6)],
+                         'strain':round(r.uniform(2,18),2),'averageHeartRate':r.randint(100,160),
+                         'maxHeartRate':r.randint(160,195),'kilojoules':round(r.uniform(300,4000),1)})
+    return {'id':day.toordinal(),'days':[day.strftime('%Y-%m-%d')],
+            'during':during(lower,lower+timedelta(days=1)),'predictedEnd':iso(lower+timedelta(days=1)),
+            'recovery':{'score':r.randint(1,99),'restingHeartRate':r.randint(42,62),
+                        'heartRateVariabilityRmssd':round(r.uniform(0.03,0.15),4)},
+            'sleep':{'id':sleep_id,'score':r.randint(40,100),'qualityDuration':r.randint(18000000,32000000),
+                     'needBreakdown':{'baseline':27000000,'debt':r.randint(0,3600000),'naps':-r.randint(0,1800000),
+                                      'strain':r.randint(0,1800000),'total':30000000},
+                     'naps':naps},
+            'strain':{'score':round(r.uniform(3,20),2),'workouts':workouts}}
+
+
+def synthetic_sleep(sleep_id):
+    '''
+    Returns the synthetic sleep detail for a sleep id from synthetic_cycle
+    '''
+    day=datetime.fromordinal(sleep_id//10)
+    r=random.Random(sleep_id)
+    start=datetime(day.year,day.month,day.day,22,tzinfo=timezone.utc)-timedelta(days=1)
+    events=[]
+    lower=start
+    for event_type in EVENT_TYPES:
+        upper=lower+timedelta(minutes=r.randint(3,80))
+        events.append({'during':during(lower,upper),'type':event_type})
+        lower=upper
+    sleep={'activityId':sleep_id,'during':during(start,lower),'events':events,'score':r.randint(40,100)}
+    for field in SLEEP_FIELDS:
+        sleep[field]=r.randint(0,30000000)
+    return sleep
+
+
+class whoop_handler(BaseHTTPRequestHandler):
+    '''Serves the WHOOP api endpoints used by whoop_login from synthetic data'''
+
+    protocol_version='HTTP/1.1'
+    ## headers and body are separate writes, without this every keep-alive request waits on a delayed ACK
+    disable_nagle_algorithm=True
+
+    def log_message(self,*args):
+        pass
+
+    def send_json(self,body,status=200):
+        content=body if isinstance(body,bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        with self.server.stats.get_lock():
+            self.server.stats[0]+=1
+            self.server.stats[1]+=len(content)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length',0)))
+        self.send_json({'access_token':'benchmark','user':{'id':self.server.whoop_id,
+                                                            'profile':{'createdAt':iso(self.server.created)}}})
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url=urlparse(self.path)
+        query={k:v[0] for k,v in parse_qs(url.query).items()}
+        path=url.path.strip('/').split('/')
+        if path==['sports']:
+            self.send_json(SPORTS)
+        elif len(path)==3 and path[2]=='cycles':
+            self.send_json(self.cycles(query))
+        elif len(path)==4 and path[2]=='sleeps':
+            self.send_json(synthetic_sleep(int(path[3])))
+        elif len(path)==4 and path[3]=='heart_rate':
+            self.send_json(self.heart_rate(query))
+        else:
+            self.send_json({},404)
+
+    def window(self,query):
+        start=max(datetime.strptime(query['start'],'%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc),self.server.created)
+        end=min(datetime.strptime(query['end'],'%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc),self.server.now)
+        return start, end
+
+    def cycles(self,query):
+        start,end=self.window(query)
+        day=start.date()
+        cycles=[]
+        while day<=end.date():
+            cycles.append(synthetic_cycle(day))
+            day+=timedelta(days=1)
+        return cycles
+
+    def heart_rate(self,query):
+        start,end=self.window(query)
+        step=int(query.get('step',6))*1000
+        first=-(-int(start.timestamp()*1000)//step)*step
+        last=int(end.timestamp()*1000)
+        ## building the json by hand keeps the server quick enough for multi-year pulls
+        values=','.join('{"time":%d,"data":%d}' % (t,55+(t//60000)%70) for t in range(first,last+1,step))
+        return ('{"values":[' + values + ']}').encode()
+
+
+def serve(port_queue,stats,years,latency):
+    now=datetime.now(timezone.utc)
+    server=ThreadingHTTPServer(('127.0.0.1',0),whoop_handler)
+    server.daemon_threads=True
+    server.stats=stats
+    server.latency=latency
+    server.whoop_id=12345
+    server.now=now
+    server.created=now-timedelta(days=int(365*years))
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(years=1,latency=0.0):
+    '''
+    Starts the stand-in api in its own process, so generating responses doesn't compete with the downloader,
+    and returns the process, its base url and the shared [requests, bytes] counters
+    '''
+    port_queue=multiprocessing.Queue()
+    stats=multiprocessing.Array('d',2)
+    process=multiprocessing.Process(target=serve,args=(port_queue,stats,years,latency),daemon=True)
+    process.start()
+    return process, 'http://127.0.0.1:{}'.format(port_queue.get()), stats
+
+
+def entry_points(timeframe_days=30):
+    '''
+    Returns the get_* calls to benchmark as (label, function name, args, kwargs)
+    '''
+    end=datetime.utcnow()
+    start=(end-timedelta(days=timeframe_days)).strftime('%Y-%m-%d')
+    end=end.strftime('%Y-%m-%d')
+    return [('get_keydata_all','get_keydata_all',(),{}),
+            ('get_keydata_timeframe','get_keydata_timeframe',(start,end),{}),
+            ('get_activities_all','get_activities_all',(),{}),
+            ('get_activities_timeframe','get_activities_timeframe',(start,end),{}),
+            ('get_sleep_all','get_sleep_all',(),{}),
+            ('get_sleep_timeframe','get_sleep_timeframe',(start,end),{}),
+            ('get_sleep_events_all','get_sleep_events_all',(),{}),
+            ('get_sleep_events_timeframe','get_sleep_events_timeframe',(start,end),{}),
+            ('get_hr_all(columnar)','get_hr_all',(),{'columnar':True}),
+            ('get_hr_timeframe','get_hr_timeframe',(start,end),{}),
+            ('get_hr_timeframe(df)','get_hr_timeframe',(start,end),{'df':True}),
+            ('get_hr_chunks','get_hr_chunks',(),{}),
+            ('get_daily_rollups','get_daily_rollups',(start,end),{}),
+            ('get_weekly_rollups','get_weekly_rollups',(start,end),{})]
+
+
+def run_entry_point(api_url,user_ini,stats,function,args,kwargs,max_workers,memory=True,transform_workers=None):
+    '''
+    Runs one get_* call on a freshly authenticated whoop_login and returns its wall time, requests, bytes, rows and peak memory
+    '''
+    client=whoop_login(max_workers=max_workers,api_url=api_url,transform_workers=transform_workers)
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.get_authorization(user_ini)
+    requests_before,bytes_before=stats[0],stats[1]
+    if memory:
+        tracemalloc.start()
+    start=time.perf_counter()
+    result=getattr(client,function)(*args,**kwargs)
+    if function=='get_hr_chunks':
+        ## chunks are streamed, so they're counted as they arrive rather than kept
+        result=range(sum(len(chunk) for chunk in result))
+    wall=time.perf_counter()-start
+    peak=tracemalloc.get_traced_memory()[1] if memory else float('nan')
+    if memory:
+        tracemalloc.stop()
+    client.close()
+    return {'wall':wall,'requests':stats[0]-requests_before,'bytes':stats[1]-bytes_before,
+            'rows':len(result) if result is not None else 0,'peak':peak}
+
+
+def report(label,max_workers,r):
+    print('{:<28}{:>8}{:>10.2f}{:>10.0f}{:>10.1f}{:>10.1f}{:>10.2f}{:>12.0f}{:>12.0f}{:>10.1f}'.format(
+        label,max_workers,r['wall'],r['requests'],r['requests']/r['wall'],r['bytes']/1e6,r['bytes']/1e6/r['wall'],
+        r['rows'],r['rows']/r['wall'],r['peak']/1e6))
+
+
+def main(argv=None):
+    arg_parser=argparse.ArgumentParser(description='Benchmark the whoop_login get_* functions against a local stand-in api')
+    arg_parser.add_argument('--years',type=float,default=1,help='length of the synthetic membership in years')
+    arg_parser.add_argument('--latency',type=float,default=0.0,help='seconds of delay added to every api request')
+    arg_parser.add_argument('--workers',type=int,nargs='+',default=[1,8],help='max_workers settings to compare')
+    arg_parser.add_argument('--timeframe-days',type=int,default=30,help='length of the *_timeframe pulls in days')
+    arg_parser.add_argument('--only',nargs='+',help='only run these entry points')
+    arg_parser.add_argument('--transform-workers',type=int,help='normalize responses in a process pool of this many workers')
+    arg_parser.add_argument('--no-memory',action='store_true',help='skip peak memory tracking, which slows the pulls down')
+    args=arg_parser.parse_args(argv)
+
+    process,api_url,stats=start_server(args.years,args.latency)
+    user_ini=os.path.join(tempfile.mkdtemp(),'whoop.ini')
+    with open(user_ini,'w') as f:
+        f.write('[whoop]\nusername=benchmark\npassword=benchmark\n')
+
+    print('{} years of synthetic data, {}s latency per request\n'.format(args.years,args.latency))
+    print('{:<28}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}{:>12}{:>12}{:>10}'.format(
+        'entry point','workers','wall s','requests','req/s','MB','MB/s','rows','rows/s','peak MB'))
+    try:
+        for label,function,fargs,kwargs in entry_points(args.timeframe_days):
+            if args.only and label not in args.only and function not in args.only:
+                continue
+            for max_workers in args.workers:
+                r=run_entry_point(api_url,user_ini,stats,function,fargs,kwargs,max_workers,memory=not args.no_memory,
+                                  transform_workers=args.transform_workers)
+                report(label,max_workers,r)
+    finally:
+        process.terminate()
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,198 @@
+'''
+Command line interface to whoop_login, for running exports from a scheduler like cron. Each command authenticates
+with the credentials in an ini file, shows the progress of every pull and reports requests/s, MB/s, rows/s and the
+total wall time when it's done.
+
+Examples:
+
+    python whoop_cli.py auth --ini whoop.ini
+    python whoop_cli.py sync --ini whoop.ini --sync-dir whoop_sync
+    python whoop_cli.py export-range 2021-01-01 2021-06-30 --out whoop_export --format parquet --workers 8
+    python whoop_cli.py export-hr whoop_export/hr --start 2021-01-01 --format parquet --workers 8
+    python whoop_cli.py export-rollups --store whoop.sqlite --out whoop_export --workers 8
+
+The exit code is 0 on success, 1 if authentication failed and 2 if the arguments are invalid (like a malformed date, or a start
+after the end) or a pull was rejected or still failed after retrying.
+'''
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+from whoop_download import whoop_login, whoop_api_error, whoop_instruments, check_format, write_frame, EXTENSIONS
+
+
+DATASETS=['keydata','activities','sleep','sleep_events']
+
+
+def progress_printer(label,stream=sys.stderr):
+    '''
+    Returns a progress function for whoop_login that keeps one line on stream up to date with the windows pulled
+    '''
+    def progress(done,total):
+        stream.write('\r{}: {}/{} windows'.format(label,done,total))
+        if done==total:
+            stream.write('\n')
+        stream.flush()
+    return progress
+
+
+def day(value):
+    '''
+    Checks a YYYY-MM-DD date argument, so a malformed date is reported as a usage error
+    '''
+    try:
+        datetime.strptime(value,'%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} isn't a YYYY-MM-DD date".format(value))
+    return value
+
+
+def set_progress(client,args,label):
+    client.progress=None if args.quiet else progress_printer(label)
+
+
+def run_auth(client,args):
+    print('whoop id: {}'.format(client.whoop_id))
+    print('member since: {}'.format(client.start_datetime))
+    return 0
+
+
+def run_sync(client,args):
+    rows=0
+    for dataset in args.datasets:
+        set_progress(client,args,'sync ' + dataset)
+        if dataset=='keydata':
+            client.sync_keydata(args.sync_dir)
+        else:
+            client.sync_hr(args.sync_dir)
+        ## only the rows this run pulled count, not the whole synced dataset
+        rows+=client.sync_rows.get(dataset,0)
+    return rows
+
+
+def run_export_range(client,args):
+    os.makedirs(args.out,exist_ok=True)
+    rows=0
+    for dataset in args.datasets:
+        set_progress(client,args,dataset)
+        data=getattr(client,'get_{}_timeframe'.format(dataset))(args.start,args.end)
+        if data is None:
+            ## the timeframe was rejected, the reason has already been printed
+            continue
+        write_frame(data,os.path.join(args.out,dataset + EXTENSIONS[args.format]),args.format)
+        rows+=len(data)
+    return rows
+
+
+def run_export_hr(client,args):
+    set_progress(client,args,'hr')
+    return client.export_hr(args.path,start=args.start,end=args.end,format=args.format,step=args.step)
+
+
+def run_export_rollups(client,args):
+    os.makedirs(args.out,exist_ok=True)
+    set_progress(client,args,'rollups')
+    rows=0
+    for period in args.periods:
+        data=getattr(client,'get_{}_rollups'.format(period))(args.start,args.end)
+        if data is None:
+            continue
+        write_frame(data,os.path.join(args.out,period + '_rollups' + EXTENSIONS[args.format]),args.format)
+        rows+=len(data)
+    return rows
+
+
+def report(wall,stats,rows,stream=sys.stdout):
+    stream.write('wall {:.2f}s, {} requests ({:.1f}/s), {:.1f} MB ({:.2f} MB/s), {} rows ({:.0f}/s)\n'.format(
+        wall,stats['requests'],stats['requests']/wall,stats['bytes']/1e6,stats['bytes']/1e6/wall,rows,rows/wall))
+
+
+def build_parser():
+    arg_parser=argparse.ArgumentParser(description='Download your WHOOP data from the command line')
+    common=argparse.ArgumentParser(add_help=False)
+    common.add_argument('--ini',default='whoop.ini',help='ini file with your WHOOP credentials')
+    common.add_argument('--section',default='whoop',help='section of the ini file to read the credentials from')
+    common.add_argument('--workers',type=int,default=1,help='number of requests in flight at once')
+    common.add_argument('--pool-size',type=int,help='number of connections kept open to the api')
+    common.add_argument('--transform-workers',type=int,help='normalize responses in a process pool of this many workers')
+    common.add_argument('--max-retries',type=int,default=5,help='number of times a throttled or failed request is retried')
+    common.add_argument('--timeout',type=float,nargs=2,default=[10,60],metavar=('CONNECT','READ'),
+                        help='seconds to wait for a connection and for the api to respond before retrying')
+    common.add_argument('--cache',help='sqlite file to cache api responses in')
+    common.add_argument('--store',help='sqlite file to keep the downloaded data in')
+    common.add_argument('--api-url',default='https://api-7.whoop.com',help='base url of the WHOOP api')
+    common.add_argument('--profile',action='store_true',help='report request latencies and the time spent in each stage')
+    common.add_argument('--quiet',action='store_true',help="don't show the progress of each pull")
+    commands=arg_parser.add_subparsers(dest='command',required=True)
+
+    commands.add_parser('auth',parents=[common],help='check your credentials')
+
+    sync=commands.add_parser('sync',parents=[common],help='bring a local copy of your key data and heart rate up to date')
+    sync.add_argument('--sync-dir',default='whoop_sync',help='folder the synced data is kept in')
+    sync.add_argument('--datasets',nargs='+',choices=['keydata','hr'],default=['keydata','hr'])
+
+    export_range=commands.add_parser('export-range',parents=[common],help='export your data between two dates')
+    export_range.add_argument('start',type=day,help='first day to export, YYYY-MM-DD')
+    export_range.add_argument('end',nargs='?',type=day,help='last day to export, YYYY-MM-DD (defaults to today)')
+    export_range.add_argument('--out',default='whoop_export',help='folder to write a file per dataset to')
+    export_range.add_argument('--datasets',nargs='+',choices=DATASETS,default=DATASETS)
+    export_range.add_argument('--format',choices=['parquet','csv','jsonl'],default='csv')
+
+    export_hr=commands.add_parser('export-hr',parents=[common],help='export your heart rate one window at a time')
+    export_hr.add_argument('path',help='folder for parquet, or the file to write csv or jsonl to')
+    export_hr.add_argument('--start',type=day,help='first day to export, YYYY-MM-DD (defaults to the start of your membership)')
+    export_hr.add_argument('--end',type=day,help='last day to export, YYYY-MM-DD (defaults to today)')
+    export_hr.add_argument('--format',choices=['parquet','csv','jsonl'],default='parquet')
+    export_hr.add_argument('--step',type=int,default=6,help='seconds between heart rate measurements')
+
+    export_rollups=commands.add_parser('export-rollups',parents=[common],help='export your daily and weekly rollups')
+    export_rollups.add_argument('--start',type=day,help='first day to export, YYYY-MM-DD (defaults to the start of your membership)')
+    export_rollups.add_argument('--end',type=day,help='last day to export, YYYY-MM-DD (defaults to today)')
+    export_rollups.add_argument('--out',default='whoop_export',help='folder to write a file per period to')
+    export_rollups.add_argument('--periods',nargs='+',choices=['daily','weekly'],default=['daily','weekly'])
+    export_rollups.add_argument('--format',choices=['parquet','csv','jsonl'],default='csv')
+    return arg_parser
+
+
+def main(argv=None):
+    arg_parser=build_parser()
+    args=arg_parser.parse_args(argv)
+    start,end=getattr(args,'start',None),getattr(args,'end',None)
+    ## without an end, the exports run up to today
+    if start and start>(end or datetime.utcnow().strftime('%Y-%m-%d')):
+        arg_parser.error('the start date {} is after the end date {}'.format(start,end or 'of today'))
+    try:
+        ## a missing Parquet engine is reported before authenticating, not after the first pull
+        check_format(getattr(args,'format',None))
+    except ImportError as e:
+        arg_parser.error(str(e))
+    client=whoop_login(max_workers=args.workers,pool_size=args.pool_size,transform_workers=args.transform_workers,
+                       max_retries=args.max_retries,timeout=tuple(args.timeout),cache=args.cache,store=args.store,api_url=args.api_url,
+                       instruments=whoop_instruments() if args.profile else None)
+    client.get_authorization(args.ini,section=args.section)
+    if not client.auth_code:
+        return 1
+    if args.command=='auth':
+        return run_auth(client,args)
+
+    commands={'sync':run_sync,'export-range':run_export_range,'export-hr':run_export_hr,
+              'export-rollups':run_export_rollups}
+    start=time.perf_counter()
+    try:
+        rows=commands[args.command](client,args)
+    except whoop_api_error as e:
+        sys.stderr.write('\n{}\n'.format(e))
+        return 2
+    finally:
+        client.close()
+    report(time.perf_counter()-start,client.stats,rows or 0)
+    if args.profile:
+        print(client.instruments.summary())
+    return 0
+
+
+if __name__=='__main__':
+    sys.exit(main())
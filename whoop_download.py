@@ -1,64 +1,1281 @@
 import requests
-import pandas as pd
-import numpy as np
+from requests.adapters import HTTPAdapter
 import configparser
-from datetime import timedelta, datetime
-from dateutil import relativedelta, parser, rrule
-from dateutil.rrule import WEEKLY
+import contextlib
+import functools
+import importlib
+import importlib.util
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import timedelta, datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse, parse_qs
+
+
+class lazy_module:
+    '''Stands in for a module that is only imported the first time one of its attributes is used,
+        so importing whoop_download and authenticating don't pay for pandas, numpy and dateutil'''
+
+    def __init__(self, name):
+        self.name=name
+        self.module=None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module=importlib.import_module(self.name)
+        return getattr(self.module,attr)
+
+
+pd=lazy_module('pandas')
+np=lazy_module('numpy')
+parser=lazy_module('dateutil.parser')
+rrule=lazy_module('dateutil.rrule')
+
+
+def timed(stage):
+    '''
+    Decorator that records how long a whoop_login method takes as a stage of its instruments, if it has any
+    '''
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self,*args,**kwargs):
+            if self.instruments is None:
+                return method(self,*args,**kwargs)
+            with self.instruments.stage(stage):
+                return method(self,*args,**kwargs)
+        return wrapper
+    return decorate
+
+
+def normalize_batch(records,record_path=None,meta=None):
+    '''
+    Normalizes a batch of records into a data frame, at module level so it can run in a process pool
+    '''
+    return pd.json_normalize(records,record_path=record_path,meta=meta)
+
+
+def check_format(format):
+    '''
+    Raises an ImportError if format is parquet and neither pyarrow nor fastparquet is installed,
+    so an export fails before anything is pulled rather than after the first window
+    '''
+    if format=='parquet' and not any(importlib.util.find_spec(engine) for engine in ('pyarrow','fastparquet')):
+        raise ImportError("Writing Parquet needs pyarrow or fastparquet - run pip install pyarrow, or choose the csv format")
+
+
+## the file extension written for each export format
+EXTENSIONS={'parquet':'.parquet','csv':'.csv','jsonl':'.jsonl'}
+
+
+def write_frame(data,path,format):
+    '''
+    Writes a data frame to path as parquet (needs pyarrow or fastparquet), csv or json lines
+    '''
+    if format=='parquet':
+        data.to_parquet(path,index=False)
+    elif format=='csv':
+        data.to_csv(path,index=False)
+    else:
+        data.to_json(path,orient='records',lines=True,date_format='iso')
+
+
+class whoop_cache:
+    '''A file backed cache of api responses, keyed by url. Responses are stored compressed in a sqlite file.
+        Responses for windows that have fully closed never expire, everything else expires after ttl seconds.
+        Once the cache grows past max_bytes, the least recently used responses are removed'''
+
+    def __init__(self, path='whoop_cache.sqlite', ttl=900, max_bytes=512*1024*1024):
+        self.path=path
+        self.ttl=ttl
+        self.max_bytes=max_bytes
+        self.lock=threading.Lock()
+        self.conn=sqlite3.connect(path,check_same_thread=False)
+        self.conn.execute('''create table if not exists responses
+                             (url text primary key, content blob, size integer, expires real, accessed real)''')
+        self.conn.commit()
+
+    def get(self,url):
+        '''
+        Returns the cached response content for a url, or None if it isn't cached or has expired
+        '''
+        now=time.time()
+        with self.lock:
+            row=self.conn.execute('select content, expires from responses where url=?',(url,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1]<now:
+                self.conn.execute('delete from responses where url=?',(url,))
+                self.conn.commit()
+                return None
+            self.conn.execute('update responses set accessed=? where url=?',(now,url))
+            self.conn.commit()
+        return zlib.decompress(row[0])
+
+    def set(self,url,content,closed=False):
+        '''
+        Stores the response content for a url. Closed responses are kept until they are evicted or the cache is cleared
+        '''
+        now=time.time()
+        packed=zlib.compress(content)
+        expires=None if closed else now+self.ttl
+        with self.lock:
+            self.conn.execute('insert or replace into responses values (?,?,?,?,?)',(url,packed,len(packed),expires,now))
+            self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used responses until the cache is no bigger than max_bytes
+        '''
+        if not self.max_bytes:
+            return
+        with self.lock:
+            total=self.conn.execute('select coalesce(sum(size),0) from responses').fetchone()[0]
+            if total<=self.max_bytes:
+                return
+            removed=[]
+            for url, size in self.conn.execute('select url, size from responses order by accessed'):
+                if total<=self.max_bytes:
+                    break
+                removed.append((url,))
+                total-=size
+            self.conn.executemany('delete from responses where url=?',removed)
+            self.conn.commit()
+
+    def clear(self):
+        '''
+        Removes every response from the cache
+        '''
+        with self.lock:
+            self.conn.execute('delete from responses')
+            self.conn.commit()
+            self.conn.execute('vacuum')
+
+
+class whoop_store:
+    '''A local sqlite store of downloaded datasets, so timeframe queries can be answered with indexed range queries
+        instead of scanning the full data in memory or going back to the api. Each dataset is a table indexed by whoop_id
+        and day (or measurement time for heart rate), and the days that have been fully downloaded are tracked per dataset'''
+
+    ## key columns (unique per row) and indexed columns for each dataset
+    datasets={'cycles':(['id'],['day']),
+              'activities':(['id'],['cycle_day']),
+              'sleeps':(['activityId'],[]),
+              'sleep_events':(['id','during.lower'],[]),
+              'hr':(['time'],[]),
+              'hr_daily':(['day'],[])}
+
+    def __init__(self, path='whoop_store.sqlite'):
+        self.path=path
+        self.lock=threading.RLock()
+        self.conn=sqlite3.connect(path,check_same_thread=False)
+        self.conn.execute('''create table if not exists coverage
+                             (whoop_id text, dataset text, start text, end text)''')
+        self.conn.execute('''create table if not exists columns
+                             (dataset text, name text, kind text, primary key (dataset, name))''')
+        self.conn.execute('''create table if not exists hr
+                             (whoop_id text, time integer, hr integer, primary key (whoop_id, time)) without rowid''')
+        self.conn.commit()
+
+    def quote(self,name):
+        return '"{}"'.format(name.replace('"','""'))
+
+    def table_columns(self,dataset):
+        return {row[0]:row[1] for row in self.conn.execute('select name, kind from columns where dataset=? order by rowid',(dataset,))}
+
+    def prepare_table(self,dataset,data):
+        '''
+        Creates the table for a dataset if needed, adds any new columns and returns the data encoded for sqlite -
+        list and dict columns are stored as json, datetime columns as ISO strings and day columns as YYYY-MM-DD strings
+        '''
+        keys,indexes=self.datasets[dataset]
+        table=self.quote(dataset)
+        self.conn.execute('create table if not exists {} (whoop_id text, {})'.format(table,', '.join(self.quote(k) for k in keys)))
+        self.conn.execute('create unique index if not exists {} on {} (whoop_id, {})'.format(
+            self.quote(dataset + '_key'),table,', '.join(self.quote(k) for k in keys)))
+        for index in indexes:
+            self.conn.execute('create index if not exists {} on {} (whoop_id, {})'.format(
+                self.quote(dataset + '_' + index),table,self.quote(index)))
+
+        known=self.table_columns(dataset)
+        data=data.copy()
+        for col in data.columns:
+            if col in ('day','cycle_day'):
+                ## day columns stay YYYY-MM-DD strings, so range queries on them work as before
+                kind='day'
+                if pd.api.types.is_datetime64_any_dtype(data[col]):
+                    data[col]=data[col].dt.strftime('%Y-%m-%d')
+            elif pd.api.types.is_datetime64_any_dtype(data[col]):
+                kind='datetime'
+                data[col]=data[col].map(lambda x: None if pd.isna(x) else x.isoformat())
+            elif data[col].dtype==object and data[col].map(lambda x: isinstance(x,(list,dict))).any():
+                kind='json'
+                data[col]=data[col].map(lambda x: json.dumps(x) if isinstance(x,(list,dict)) else x)
+            else:
+                kind=known.get(col,'value')
+            if col not in known:
+                if col not in keys:
+                    self.conn.execute('alter table {} add column {}'.format(table,self.quote(col)))
+                self.conn.execute('insert into columns values (?,?,?)',(dataset,col,kind))
+        return data.astype(object).where(data.notna(),None)
+
+    def save(self,dataset,whoop_id,data,start,end):
+        '''
+        Adds the rows of a dataset to the store, replacing rows with the same key, and marks the days from start to end
+        (as YYYY-MM-DD strings) as fully downloaded. If end is None or before start, nothing is marked.
+        '''
+        with self.lock:
+            if dataset=='hr':
+                times=data.index.values.astype('datetime64[ms]').astype(np.int64).tolist()
+                rows=zip(itertools.repeat(str(whoop_id)),times,data['hr'].astype(int).tolist())
+                self.conn.executemany('insert or replace into hr values (?,?,?)',((w,int(t),h) for w,t,h in rows))
+            elif len(data)>0:
+                data=self.prepare_table(dataset,data)
+                cols=['whoop_id'] + list(data.columns)
+                self.conn.executemany('insert or replace into {} ({}) values ({})'.format(
+                    self.quote(dataset),', '.join(self.quote(c) for c in cols),', '.join('?'*len(cols))),
+                    ([str(whoop_id)] + list(row) for row in data.itertuples(index=False)))
+            if end is not None and start<=end and not self.covers(dataset,whoop_id,start,end):
+                self.conn.execute('insert into coverage values (?,?,?,?)',(str(whoop_id),dataset,start,end))
+            self.conn.commit()
+
+    def covers(self,dataset,whoop_id,start,end):
+        '''
+        Returns True if every day from start to end (as YYYY-MM-DD strings) has been fully downloaded for a dataset
+        '''
+        return len(self.missing(dataset,whoop_id,start,end))==0
+
+    def missing(self,dataset,whoop_id,start,end):
+        '''
+        Returns the [start, end] ranges of days from start to end (as YYYY-MM-DD strings) that haven't been
+        fully downloaded for a dataset
+        '''
+        with self.lock:
+            ranges=self.conn.execute('select start, end from coverage where whoop_id=? and dataset=? order by start',
+                                     (str(whoop_id),dataset)).fetchall()
+        ## walking through the ranges in order, moving up the first day that still needs covering
+        gaps=[]
+        needed=start
+        for range_start, range_end in ranges:
+            if needed>end:
+                break
+            if range_start>needed:
+                gap_end=(datetime.strptime(range_start,'%Y-%m-%d')-timedelta(days=1)).strftime('%Y-%m-%d')
+                gaps.append([needed,min(gap_end,end)])
+            if range_end>=needed:
+                needed=(datetime.strptime(range_end,'%Y-%m-%d')+timedelta(days=1)).strftime('%Y-%m-%d')
+        if needed<=end:
+            gaps.append([needed,end])
+        return gaps
+
+    def load(self,dataset,whoop_id,start,end):
+        '''
+        Returns the rows of a dataset from start to end (as YYYY-MM-DD strings). Activities are matched by the day
+        of their cycle, and sleeps and sleep events through the sleep ids of the cycles in that timeframe, the same way
+        they're picked when they're pulled
+        '''
+        whoop_id=str(whoop_id)
+        if dataset=='hr':
+            low=int(datetime.strptime(start,'%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()*1000)
+            high=int((datetime.strptime(end,'%Y-%m-%d')+timedelta(days=1)).replace(tzinfo=timezone.utc).timestamp()*1000)-1
+            with self.lock:
+                rows=self.conn.execute('select time, hr from hr where whoop_id=? and time between ? and ? order by time',
+                                       (whoop_id,low,high)).fetchall()
+            times=np.array([r[0] for r in rows],dtype=np.int64)
+            hrs=np.array([r[1] for r in rows],dtype=np.uint8)
+            return times, hrs
+
+        with self.lock:
+            kinds=self.table_columns(dataset)
+            if not kinds:
+                ## only empty data has been saved (like rollups of days without heart rate), so the table doesn't exist yet
+                schema={'cycles':'keydata','sleeps':'sleep'}.get(dataset,dataset)
+                return pd.DataFrame(columns=list(whoop_login.schemas.get(schema,{})))
+            cols=', '.join(self.quote(c) for c in kinds)
+            table=self.quote(dataset)
+            if dataset in ('cycles','activities','hr_daily'):
+                day=self.quote('cycle_day' if dataset=='activities' else 'day')
+                query='select {} from {} where whoop_id=? and {} between ? and ? order by {}'.format(cols,table,day,day)
+            else:
+                key='activityId' if dataset=='sleeps' else 'id'
+                query='''select {} from {} where whoop_id=? and {} in
+                           (select "sleep.id" from cycles where whoop_id=? and day between ? and ?)
+                           order by {}'''.format(cols,table,self.quote(key),self.quote(key))
+            params=(whoop_id,start,end) if dataset in ('cycles','activities','hr_daily') else (whoop_id,whoop_id,start,end)
+            data=pd.read_sql_query(query,self.conn,params=params)
+        for col, kind in kinds.items():
+            if kind=='datetime':
+                data[col]=pd.to_datetime(data[col],utc=True)
+            elif kind=='day':
+                data[col]=pd.to_datetime(data[col],format='%Y-%m-%d')
+            elif kind=='json':
+                data[col]=data[col].map(lambda x: json.loads(x) if isinstance(x,str) else x)
+        return data
+
+
+class whoop_api_error(Exception):
+    '''Raised when the api rejects a pull (a 4xx status other than 429, like an expired token) or a pull
+        still fails after every retry. Windows pulled before the failure are kept,
+        so running the same function again resumes where it stopped'''
+
+    def __init__(self, url, status):
+        self.url=url
+        self.status=status
+        super().__init__('Pull failed ({}): {}'.format(status,url))
+
+
+class whoop_throttle:
+    '''Limits the number of requests in flight. The limit is halved whenever the api throttles a request (429)
+        and grows back by one after each run of successful requests, up to max_limit.
+
+        One throttle can be shared by several logins. Free slots then go to whichever waiting login has the
+        fewest requests in flight, so no login can crowd out the others, and with rate set, requests are
+        started no faster than rate per second across all of them'''
+
+    def __init__(self, max_limit, rate=None):
+        self.max_limit=max_limit
+        self.limit=max_limit
+        self.in_flight=0
+        self.successes=0
+        self.rate=rate
+        self.next_start=0.0
+        ## requests in flight and requests waiting for a slot, by owner
+        self.owner_in_flight={}
+        self.owner_waiting={}
+        self.condition=threading.Condition()
+
+    def resize(self,max_limit):
+        '''
+        Changes the most requests that can be in flight, starting again from the new limit
+        '''
+        with self.condition:
+            self.max_limit=max_limit
+            self.limit=max_limit
+            self.successes=0
+            self.condition.notify_all()
+
+    def fair_turn(self,owner):
+        waiting=[self.owner_in_flight.get(o,0) for o, n in self.owner_waiting.items() if n>0]
+        return self.owner_in_flight.get(owner,0)<=min(waiting)
+
+    def acquire(self,owner=None):
+        with self.condition:
+            self.owner_waiting[owner]=self.owner_waiting.get(owner,0)+1
+            while self.in_flight>=self.limit or not self.fair_turn(owner):
+                self.condition.wait()
+            self.owner_waiting[owner]-=1
+            self.owner_in_flight[owner]=self.owner_in_flight.get(owner,0)+1
+            self.in_flight+=1
+            wait=0.0
+            if self.rate:
+                now=time.monotonic()
+                wait=self.next_start-now
+                self.next_start=max(self.next_start,now)+1.0/self.rate
+            self.condition.notify_all()
+        if wait>0:
+            time.sleep(wait)
+
+    def release(self,owner=None):
+        with self.condition:
+            self.in_flight-=1
+            self.owner_in_flight[owner]-=1
+            self.condition.notify_all()
+
+    def succeeded(self):
+        with self.condition:
+            self.successes+=1
+            if self.successes>=self.limit and self.limit<self.max_limit:
+                self.limit+=1
+                self.successes=0
+                self.condition.notify_all()
+
+    def throttled(self):
+        with self.condition:
+            self.limit=max(1,self.limit//2)
+            self.successes=0
+
+
+class whoop_instruments:
+    '''Records what a whoop_login spends its time on - every api request (latency, status, payload size and retry)
+        and every stage of a pull (fetch, decode, normalize, clean and concat). Each event is passed to the exporters,
+        functions called with a dict describing the event, and summary() reports the totals'''
+
+    def __init__(self, exporters=None):
+        self.exporters=list(exporters or [])
+        self.lock=threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.latencies=[]
+            self.statuses={}
+            self.bytes=0
+            self.retries=0
+            ## calls and total seconds of each stage
+            self.stages={}
+
+    def export(self,event):
+        for exporter in self.exporters:
+            exporter(event)
+
+    def record_request(self,url,status,latency,size,retry):
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status]=self.statuses.get(status,0)+1
+            self.bytes+=size
+            self.retries+=retry>0
+        if self.exporters:
+            self.export({'event':'request','url':url,'status':status,'latency':latency,'bytes':size,'retry':retry})
+
+    def record_stage(self,stage,seconds):
+        with self.lock:
+            calls,total=self.stages.get(stage,(0,0.0))
+            self.stages[stage]=(calls+1,total+seconds)
+        if self.exporters:
+            self.export({'event':'stage','stage':stage,'seconds':seconds})
+
+    @contextlib.contextmanager
+    def stage(self,stage):
+        start=time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage,time.perf_counter()-start)
+
+    def summary(self):
+        '''
+        Returns a report of the requests and stages recorded so far. Stages run in several threads at once
+        add up the time of every thread, so they can add up to more than the wall time
+        '''
+        with self.lock:
+            latencies=sorted(self.latencies)
+            lines=['requests: {} ({}), {} retried, {:.1f} MB'.format(
+                len(latencies),', '.join('{}: {}'.format(k,v) for k,v in self.statuses.items()),self.retries,self.bytes/1e6)]
+            if latencies:
+                lines.append('latency ms: mean {:.1f}, p50 {:.1f}, p95 {:.1f}, max {:.1f}'.format(
+                    1000*sum(latencies)/len(latencies),1000*latencies[len(latencies)//2],
+                    1000*latencies[min(len(latencies)-1,int(len(latencies)*0.95))],1000*latencies[-1]))
+            lines.append('{:<12}{:>8}{:>12}{:>12}'.format('stage','calls','total s','mean ms'))
+            for stage,(calls,total) in self.stages.items():
+                lines.append('{:<12}{:>8}{:>12.3f}{:>12.2f}'.format(stage,calls,total,1000*total/calls))
+        return '\n'.join(lines)
+
+
+class whoop_datasets:
+    '''Lazy views of the data of a whoop_login. Each dataset is pulled the first time it's used and kept
+        until it's refreshed, e.g. client.datasets.keydata or client.datasets.refresh('keydata')'''
+
+    def __init__(self, login):
+        self.login=login
+        self.hr_data=None
+
+    @property
+    def keydata(self):
+        return self.login.get_keydata_all()
+
+    @property
+    def activities(self):
+        return self.login.get_activities_all()
+
+    @property
+    def sleep(self):
+        return self.login.get_sleep_all()
+
+    @property
+    def sleep_events(self):
+        return self.login.get_sleep_events_all()
+
+    @property
+    def hr(self):
+        '''
+        The compact heart rate data frame of the whole membership, indexed by measurement time
+        '''
+        if self.hr_data is None:
+            self.hr_data=self.login.get_hr_all(columnar=True)
+        return self.hr_data
+
+    def refresh(self,*names):
+        '''
+        Drops the named datasets (or all of them if no names are given), so they're pulled again the next time
+        they're used. The activities, sleep and sleep events are built from the key data, so refreshing the key data
+        rebuilds them too
+        '''
+        names=names or ('keydata','activities','sleep','sleep_events','hr')
+        login=self.login
+        if 'keydata' in names:
+            login.all_data=None
+            login.all_workouts=None
+        if 'activities' in names:
+            login.all_activities=None
+            login.derived_cache.pop('activities',None)
+        if 'sleep' in names or 'sleep_events' in names:
+            ## both are built from the same sleep details, so those are pulled again
+            login.sleep_payloads={}
+            login.sleeps_built={'sleep':set(),'sleep_events':set()}
+        if 'sleep' in names:
+            login.all_sleep=None
+            login.derived_cache.pop('sleep',None)
+        if 'sleep_events' in names:
+            login.all_sleep_events=None
+            login.derived_cache.pop('sleep_events',None)
+        if 'hr' in names:
+            self.hr_data=None
 
 
 class whoop_login:
     '''A class object to allow a user to login and store their authorization code,
         then perform pulls using the code in order to access different types of data'''
 
-    def __init__(self, auth_code=None, whoop_id=None,current_datetime=datetime.utcnow()):
+    ## the type of each column of the returned data frames - utc datetimes, days, categories, integers
+    ## downcast to the smallest type that fits (float32 if any are missing), float32 or 64 bit ids
+    schemas={'keydata':{'id':'int64','day':'day','predictedEnd':'datetime','during.bounds':'category',
+                        'during.lower':'datetime','during.upper':'datetime','recovery.score':'int',
+                        'recovery.restingHeartRate':'int','recovery.heartRateVariabilityRmssd':'float',
+                        'sleep.id':'Int64','sleep.qualityDuration':'float','sleep.score':'int',
+                        'sleep.needBreakdown.baseline':'float','sleep.needBreakdown.debt':'float',
+                        'sleep.needBreakdown.naps':'float','sleep.needBreakdown.strain':'float',
+                        'sleep.needBreakdown.total':'float','strain.score':'float','nap_duration':'float'},
+             'activities':{'id':'int64','sportId':'int','strain':'float','averageHeartRate':'int','maxHeartRate':'int',
+                           'kilojoules':'float','during.lower':'datetime','during.upper':'datetime','total_minutes':'float',
+                           'zone1_minutes':'float','zone2_minutes':'float','zone3_minutes':'float','zone4_minutes':'float',
+                           'zone5_minutes':'float','zone6_minutes':'float','sport_name':'category','day':'day',
+                           'cycle_day':'day'},
+             'sleep':{'activityId':'int64','score':'int','qualityDuration':'float','latency':'float','debtPre':'float',
+                      'debtPost':'float','needFromStrain':'float','sleepNeed':'float','habitualSleepNeed':'float',
+                      'timeInBed':'float','lightSleepDuration':'float','slowWaveSleepDuration':'float',
+                      'remSleepDuration':'float','wakeDuration':'float','arousalTime':'float','noDataDuration':'float',
+                      'creditFromNaps':'float','projectedSleep':'float','during.lower':'datetime','during.upper':'datetime'},
+             'sleep_events':{'type':'category','during.lower':'datetime','during.upper':'datetime','id':'int64',
+                             'total_minutes':'float'},
+             'hr_daily':{'day':'day','hr_min':'int','hr_avg':'float','hr_max':'int','hr_samples':'int',
+                         'zone1_minutes':'float','zone2_minutes':'float','zone3_minutes':'float','zone4_minutes':'float',
+                         'zone5_minutes':'float'}}
+    ## batches normalized in the process pool hold at least this many records
+    min_transform_batch=100
+    ## heart rate zones start at these fractions of max_hr
+    hr_zones=(0.5,0.6,0.7,0.8,0.9)
+    ## key data columns added to the daily rollups, and how each column is rolled up into weeks.
+    ## The weekly hr_avg is weighted by each day's hr_samples, so a partial day counts for less than a full one
+    rollup_keydata=['strain.score','recovery.score','recovery.restingHeartRate','recovery.heartRateVariabilityRmssd',
+                    'sleep.score','sleep.qualityDuration']
+    weekly_rollup={'strain.score':'mean','recovery.score':'mean','recovery.restingHeartRate':'mean',
+                   'recovery.heartRateVariabilityRmssd':'mean','sleep.score':'mean','sleep.qualityDuration':'mean',
+                   'hr_min':'min','hr_avg':'weighted','hr_max':'max','hr_samples':'sum','zone1_minutes':'sum',
+                   'zone2_minutes':'sum','zone3_minutes':'sum','zone4_minutes':'sum','zone5_minutes':'sum'}
+
+    def __init__(self, auth_code=None, whoop_id=None,current_datetime=None,max_workers=1,pool_size=None,
+                 cache=None,settle_time=timedelta(days=1),api_url='https://api-7.whoop.com',
+                 max_retries=5,backoff=1.0,max_backoff=60.0,store=None,throttle=None,transform_workers=None,
+                 transform_batch=1000,instruments=None,max_hr=190,timeout=(10,60)):
         self.auth_code=auth_code
         self.whoop_id=whoop_id
-        self.current_datetime=current_datetime
+        ## None means now, resolved every time it's used, so long running sessions don't get stuck on one day
+        self.fixed_datetime=current_datetime
+        self.api_url=api_url
         self.start_datetime=None
         self.all_data=None
+        ## the nested workouts of each day in all_data, kept apart so the key data stays compact
+        self.all_workouts=None
         self.all_activities=None
         self.sport_dict=None
         self.all_sleep=None
         self.all_sleep_events=None
+        ## False if a window of the all_data pull came back without data
+        self.all_data_complete=True
+        ## datasets derived from all_data or all_workouts, with the source each was derived from
+        self.derived_cache={}
+        self.datasets=whoop_datasets(self)
+        ## raw sleep details pulled but not yet built into both the sleep and the sleep events data,
+        ## and the sleep ids each of the two has been built for
+        self.sleep_payloads={}
+        self.sleeps_built={'sleep':set(),'sleep_events':set()}
+        ## heart rate windows are sized to hold about this many measurements - a week at the default 6 second step
+        self.hr_window_samples=100800
+        ## the heart rate zones of the rollups are fractions of max_hr
+        self.max_hr=max_hr
+        ## a throttle can be shared with other logins, see whoop_team. Its cap is set where it's created,
+        ## a throttle of the login's own follows max_workers
+        self.throttle=throttle if throttle is not None else whoop_throttle(max(1,max_workers or 1))
+        self.own_throttle=throttle is None
+        ## one pooled session per login so connections are kept alive between pulls. Without a pool_size,
+        ## the pool is resized with max_workers, so it's always at least as big as the number of requests that can be in flight
+        self.session=requests.Session()
+        self.session.headers['authorization']=auth_code
+        self.fixed_pool_size=pool_size
+        self.pool_size=None
+        if pool_size:
+            self.mount_pool(pool_size)
+        self.max_workers=max_workers
+        ## (connect, read) seconds before a request is given up on and retried, so a stalled connection can't hang a pull
+        self.timeout=timeout
+        ## responses are only cached when a cache or a cache file path is provided
+        self.cache=whoop_cache(cache) if isinstance(cache,str) else cache
+        self.settle_time=settle_time
+        ## throttled and failed pulls are retried with an exponential backoff, and the number of
+        ## requests in flight shrinks while the api is throttling
+        self.max_retries=max_retries
+        self.backoff=backoff
+        self.max_backoff=max_backoff
+        ## compressed responses of the windows pulled so far in an unfinished pull
+        self.checkpoint={}
+        ## with transform_workers set, responses are normalized in batches of up to transform_batch records
+        ## in a process pool while the rest are still being pulled. The pool is started on first use and kept until close()
+        self.transform_workers=transform_workers
+        self.transform_batch=transform_batch
+        self.transform_pool=None
+        self.transform_lock=threading.Lock()
+        ## requests made and bytes pulled so far, and an optional function called as progress(done,total)
+        ## each time a window of a pull finishes
+        self.stats={'requests':0,'bytes':0}
+        self.stats_lock=threading.Lock()
+        ## pulls that came back without data, so a timeframe with a missing window isn't marked as downloaded in the store
+        self.missed_pulls=0
+        ## rows pulled by the last sync of each dataset, as opposed to the whole synced dataset that's returned
+        self.sync_rows={}
+        self.progress=None
+        ## timings are only recorded when a whoop_instruments is provided
+        self.instruments=instruments
+        ## downloaded datasets are only kept in a local store when a store or a store file path is provided
+        self.store=whoop_store(store) if isinstance(store,str) else store
+
+
+    @property
+    def current_datetime(self):
+        '''
+        The end of the "all" pulls - the current_datetime the class was created with, or now (in UTC) if there wasn't one
+        '''
+        return self.fixed_datetime if self.fixed_datetime is not None else datetime.utcnow()
 
+    @current_datetime.setter
+    def current_datetime(self,value):
+        self.fixed_datetime=value
 
-    def pull_api(self, url,df=False):
-        auth_code=self.auth_code
-        headers={'authorization':auth_code}
-        pull=requests.get(url,headers=headers)
-        if pull.status_code==200 and len(pull.content)>1:
-            if df:
-                d=pd.json_normalize(pull.json())
-                return d
-            else:
-                return pull.json()
-        else:
+    @property
+    def max_workers(self):
+        '''
+        The number of requests that can be in flight at once
+        '''
+        return self.worker_limit
+
+    @max_workers.setter
+    def max_workers(self,value):
+        self.worker_limit=value
+        ## a shared throttle keeps the cap it was created with, so one login can't change it for the others
+        if self.own_throttle:
+            self.throttle.resize(max(1,value or 1))
+        if not self.fixed_pool_size:
+            self.mount_pool(max(10,value or 1))
+
+    def mount_pool(self,pool_size):
+        '''
+        Mounts a connection pool of pool_size connections on the session, unless it already has one of that size
+        '''
+        if pool_size!=self.pool_size:
+            self.pool_size=pool_size
+            adapter=HTTPAdapter(pool_connections=pool_size,pool_maxsize=pool_size)
+            self.session.mount('https://',adapter)
+            self.session.mount('http://',adapter)
+
+    def pull_api(self, url,df=False,use_cache=True,checkpoint=False):
+        content=self.pull_content(url,use_cache=use_cache,checkpoint=checkpoint)
+        if content is None:
             return "no response"
+        if df:
+            d=pd.json_normalize(self.decode(content))
+            return d
+        else:
+            return self.decode(content)
 
-    def pull_sleep_main(self,sleep_id):
+    @timed('decode')
+    def decode(self,content):
+        return json.loads(content)
+
+    @timed('fetch')
+    def pull_content(self,url,use_cache=True,checkpoint=False):
+        '''
+        Returns the raw content pulled from a url, or None if the api didn't return any data.
+        Content comes from the cache when there is one, otherwise from the checkpoint if checkpoint=True,
+        and new pulls are added to whichever of the two is in use. Only closed windows are checkpointed,
+        since a window that's still open can change before the pull is run again
+        '''
+        use_cache=use_cache and self.cache is not None
+        ## the cache already keeps finished windows, so the checkpoint is only needed without one
+        checkpoint=checkpoint and not use_cache
+        if checkpoint and url in self.checkpoint:
+            return zlib.decompress(self.checkpoint[url])
+        content=self.cache.get(url) if use_cache else None
+        if content is None:
+            content=self.request_content(url)
+            if content is not None and use_cache:
+                self.cache.set(url,content,closed=self.window_closed(url))
+        if content is not None and checkpoint and self.window_closed(url):
+            self.checkpoint[url]=zlib.compress(content)
+        return content
+
+    def request_content(self,url):
+        '''
+        Requests a url from the api and returns its content, or None if the api returned an empty body.
+        Throttled (429) and failed (5xx, connection error or timeout) requests are retried up to max_retries times,
+        waiting as long as the api asks in its Retry-After header, or an exponential backoff with jitter otherwise.
+        Raises a whoop_api_error if the last retry fails too, or straight away if the api rejects the request
+        (any other 4xx, like 401 for an expired token), rather than leaving a gap in the data.
+        '''
+        if self.session.headers.get('authorization')!=self.auth_code:
+            ## auth code was changed outside of get_authorization
+            self.session.headers['authorization']=self.auth_code
+        for attempt in range(self.max_retries+1):
+            self.throttle.acquire(self)
+            start=time.perf_counter()
+            try:
+                pull=self.session.get(url,timeout=self.timeout)
+                status=pull.status_code
+            except requests.Timeout:
+                pull=None
+                status='timeout'
+            except requests.ConnectionError:
+                pull=None
+                status='connection error'
+            finally:
+                self.throttle.release(self)
+            size=len(pull.content) if pull is not None else 0
+            with self.stats_lock:
+                self.stats['requests']+=1
+                self.stats['bytes']+=size
+            if self.instruments is not None:
+                self.instruments.record_request(url,status,time.perf_counter()-start,size,attempt)
+
+            if status==200:
+                self.throttle.succeeded()
+                return pull.content if len(pull.content)>1 else None
+            elif status==429:
+                self.throttle.throttled()
+            elif pull is not None and status<500:
+                raise whoop_api_error(url,status)
+            if attempt==self.max_retries:
+                raise whoop_api_error(url,status)
+            time.sleep(self.retry_wait(pull,attempt))
+
+    def retry_wait(self,pull,attempt):
+        '''
+        Returns the number of seconds to wait before retrying a pull - the Retry-After header if the api sent one,
+        otherwise a random wait of up to backoff * 2^attempt seconds, capped at max_backoff
+        '''
+        retry_after=pull.headers.get('Retry-After') if pull is not None else None
+        if retry_after:
+            try:
+                return max(0.0,float(retry_after))
+            except ValueError:
+                try:
+                    return max(0.0,(parsedate_to_datetime(retry_after)-datetime.now(timezone.utc)).total_seconds())
+                except (TypeError,ValueError):
+                    pass
+        return random.uniform(0,min(self.max_backoff,self.backoff*2**attempt))
+
+    def window_closed(self,url):
+        '''
+        Returns True if the url pulls a window that ended more than settle_time ago, so its data can no longer change
+        '''
+        end=parse_qs(urlparse(url).query).get('end')
+        if end:
+            return parser.isoparse(end[0])<datetime.now(timezone.utc)-self.settle_time
+        else:
+            return False
+
+    def pull_api_many(self,urls,df=False):
+        '''
+        Pulls each url in a list and returns the responses in the same order as the urls.
+        If max_workers is greater than 1, up to max_workers requests are in flight at once,
+        otherwise the urls are pulled one at a time.
+        '''
+        return list(self.iter_api_many(urls,df=df))
+
+    def iter_api_many(self,urls,df=False,checkpoint=True):
+        '''
+        Pulls each url in a list and yields the responses in the same order as the urls.
+        If max_workers is greater than 1, up to max_workers requests are in flight at once. Pulls never run
+        more than max_workers urls ahead of the response being yielded, so memory stays bounded however many urls there are.
+
+        With checkpoint=True, every finished pull of a closed window is kept until all of the urls are done, so if a pull
+        fails part way through, running it again only pulls the closed windows that weren't finished and the open ones.
+        '''
+        done=0
+        if self.max_workers and self.max_workers>1 and len(urls)>1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers,len(urls))) as pool:
+                url_iter=iter(urls)
+                pending=deque(pool.submit(self.pull_api,url,df,True,checkpoint) for url in itertools.islice(url_iter,self.max_workers))
+                while pending:
+                    result=pending.popleft().result()
+                    for url in itertools.islice(url_iter,1):
+                        pending.append(pool.submit(self.pull_api,url,df,True,checkpoint))
+                    done+=1
+                    self.count_missed(result)
+                    if self.progress:
+                        self.progress(done,len(urls))
+                    yield result
+        else:
+            for url in urls:
+                result=self.pull_api(url,df=df,checkpoint=checkpoint)
+                done+=1
+                self.count_missed(result)
+                if self.progress:
+                    self.progress(done,len(urls))
+                yield result
+        ## every url is done, so the checkpoint isn't needed anymore
+        for url in urls:
+            self.checkpoint.pop(url,None)
+
+    def count_missed(self,result):
+        if isinstance(result,str) and result=="no response":
+            self.missed_pulls+=1
+
+    def iter_records(self,urls):
+        '''
+        Pulls each url and yields the records from every response, in the order of the urls
+        '''
+        for pull in self.iter_api_many(urls):
+            if isinstance(pull,list):
+                yield from pull
+            elif pull!="no response":
+                yield pull
+
+    def pull_records(self,urls):
+        '''
+        Pulls each url and collects the records from every response into one list, in the order of the urls,
+        so they can be normalized into a data frame in one go rather than one response at a time
+        '''
+        return list(self.iter_records(urls))
+
+    def normalize_records(self,records,record_path=None,meta=None,expected=None):
+        '''
+        Normalizes records (a list, or a generator still pulling them) into one data frame.
+        If transform_workers is greater than 1, batches of records are normalized in the login's process pool
+        as soon as they're pulled, and the batches are joined in their original order, so the result is the same
+        as normalizing every record in one go. Batches hold up to transform_batch records, split so there are at least
+        as many batches as processes when the number of records expected is known (see transform_processes).
+        Records that fit in one batch are normalized in place, as there's nothing to run in parallel
+        '''
+        if self.transform_processes()<=1:
+            ## the records are pulled first, so only the normalizing is timed
+            records=list(records)
+            with self.stage('normalize'):
+                return pd.json_normalize(records,record_path=record_path,meta=meta)
+        if expected is None and isinstance(records,list):
+            expected=len(records)
+        batch_size=self.transform_batch
+        if expected is not None:
+            batch_size=max(self.min_transform_batch,min(batch_size,-(-expected//self.transform_processes())))
+        records=iter(records)
+        batch=list(itertools.islice(records,batch_size))
+        next_batch=list(itertools.islice(records,batch_size))
+        if not next_batch:
+            with self.stage('normalize'):
+                return pd.json_normalize(batch,record_path=record_path,meta=meta)
+        pool=self.transform_executor()
+        batches=[]
+        while batch:
+            batches.append(pool.submit(normalize_batch,batch,record_path,meta))
+            batch,next_batch=next_batch,list(itertools.islice(records,batch_size))
+        ## batches are normalized while the pull goes on, so this only times the wait for the last of them
+        with self.stage('normalize'):
+            frames=[b.result() for b in batches]
+        with self.stage('concat'):
+            data=pd.concat(frames,ignore_index=True)
+            ## a column that's empty in some batches comes back as objects, so the types are inferred again
+            return data.infer_objects()
+
+    def transform_executor(self):
+        '''
+        Returns the process pool that normalizes responses, starting it the first time it's needed.
+        It's kept until close(), so its processes are only started once per session
+        '''
+        with self.transform_lock:
+            if self.transform_pool is None:
+                ## the pool is started while pulls are running in other threads, so its workers aren't forked
+                ## from this process, where those threads could be holding locks the workers would then wait on forever
+                context=multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+                self.transform_pool=ProcessPoolExecutor(max_workers=self.transform_processes(),mp_context=context)
+            return self.transform_pool
+
+    def transform_processes(self):
+        '''
+        Returns the number of processes that normalize responses - transform_workers, but no more than the number of CPUs,
+        as extra processes on a CPU that's already busy only add the cost of copying the records to them
+        '''
+        return min(self.transform_workers or 1,os.cpu_count() or 1)
+
+    def close(self):
+        '''
+        Shuts down the process pool, if it was started, and closes the connections to the api
+        '''
+        with self.transform_lock:
+            if self.transform_pool is not None:
+                self.transform_pool.shutdown()
+                self.transform_pool=None
+        self.session.close()
+
+    def stage(self,stage):
+        '''
+        Returns a context manager that records the time spent in it as a stage of the instruments, if there are any
+        '''
+        return self.instruments.stage(stage) if self.instruments is not None else contextlib.nullcontext()
+
+    def week_windows(self,start,until,days=7):
+        '''
+        Returns a list of [start, end] UTC timestamp strings, one for every window of days (a week by default)
+        from the day of start to the end of the day of until. Datetimes without a timezone are taken as UTC.
+        The windows are contiguous and don't overlap - each one ends a millisecond before the next one starts,
+        and the last one ends with the day of until. Windows never start before the first day of your membership.
+        '''
+        start=start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+        until=until if until.tzinfo else until.replace(tzinfo=timezone.utc)
+        first=start.astimezone(timezone.utc).replace(hour=0,minute=0,second=0,microsecond=0)
+        if self.start_datetime:
+            first=max(first,parser.isoparse(self.start_datetime).astimezone(timezone.utc).replace(hour=0,minute=0,second=0,microsecond=0))
+        end=until.astimezone(timezone.utc).replace(hour=0,minute=0,second=0,microsecond=0)+timedelta(days=1)
+        window_starts=rrule.rrule(freq=rrule.DAILY,interval=days,dtstart=first,until=end-timedelta(milliseconds=1))
+        windows=[]
+        for window_start in window_starts:
+            window_end=min(window_start+timedelta(days=days),end)-timedelta(milliseconds=1)
+            windows.append([window_start.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+                            window_end.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'])
+        return windows
+
+    def hr_windows(self,start,until,step=6):
+        '''
+        Returns the [start, end] windows for a heart rate pull between start and until, with step seconds between measurements.
+        Windows are sized to hold about hr_window_samples measurements, so coarse pulls use a few long windows
+        and fine pulls use windows short enough not to time out - a week at 6 seconds, 10 weeks at 60 seconds
+        '''
+        days=int(min(366,max(1,round(self.hr_window_samples*step/86400.))))
+        return self.week_windows(start,until,days=days)
+
+    def pull_sleeps(self,sleep_ids):
+        '''
+        Pulls the detail for each sleep id, using up to max_workers requests at once, and returns the sleeps in
+        the order of the ids. The responses are kept in sleep_payloads until both the sleep and sleep events data
+        have been built from them (see release_sleeps), so building the second one doesn't pull them again.
+        '''
+        return list(self.iter_sleeps(sleep_ids))
+
+    def release_sleeps(self,dataset,sleep_ids):
+        '''
+        Records that dataset (sleep or sleep_events) has been built for the sleep ids, and drops the raw details
+        of the sleeps both of them have been built for, so a long running session doesn't hold on to them
+        '''
+        built=self.sleeps_built[dataset]
+        other=self.sleeps_built['sleep_events' if dataset=='sleep' else 'sleep']
+        for sleep_id in sleep_ids:
+            if sleep_id in other:
+                other.discard(sleep_id)
+                self.sleep_payloads.pop(sleep_id,None)
+            elif sleep_id in self.sleep_payloads:
+                built.add(sleep_id)
+
+    def iter_sleeps(self,sleep_ids):
+        '''
+        Yields the detail for each sleep id in order, as soon as it's pulled - see pull_sleeps
+        '''
         athlete_id=self.whoop_id
-        sleep=self.pull_api('https://api-7.whoop.com/users/{}/sleeps/{}'.format(athlete_id,sleep_id))
-        main_df=pd.json_normalize(sleep)
+        new_ids=[s for s in dict.fromkeys(sleep_ids) if s not in self.sleep_payloads]
+        sleep_urls=['{}/users/{}/sleeps/{}'.format(self.api_url,athlete_id,s) for s in new_ids]
+        pulls=zip(new_ids,self.iter_api_many(sleep_urls))
+        for sleep_id in sleep_ids:
+            if sleep_id not in self.sleep_payloads:
+                ## new ids are pulled in the order they first appear, so pulling up to this one is enough
+                for s, sleep in pulls:
+                    if sleep!="no response":
+                        self.sleep_payloads[s]=sleep
+                    if s==sleep_id:
+                        break
+            if sleep_id in self.sleep_payloads:
+                yield self.sleep_payloads[sleep_id]
+        for s, sleep in pulls:
+            if sleep!="no response":
+                self.sleep_payloads[s]=sleep
+
+    def normalize_sleep_events(self,sleeps):
+        '''
+        Flattens the events of a list of sleeps into a dataframe, where each row is an event tagged with its sleep id
+        '''
+        events_df=self.normalize_records(sleeps,record_path='events',meta=['activityId'])
+        events_df.rename(columns={'activityId':'id'},inplace=True)
+        events_df['id']=pd.to_numeric(events_df['id'])
+        return events_df
+
+    def pull_sleep_main(self,sleep_id):
+        main_df=pd.json_normalize(self.pull_sleeps([sleep_id]))
+        self.release_sleeps('sleep',[sleep_id])
         return main_df
 
     def pull_sleep_events(self,sleep_id):
-        athlete_id=self.whoop_id
-        sleep=self.pull_api('https://api-7.whoop.com/users/{}/sleeps/{}'.format(athlete_id,sleep_id))
-        events_df=pd.json_normalize(sleep['events'])
+        events_df=self.normalize_sleep_events(self.pull_sleeps([sleep_id]))
         events_df['id']=sleep_id
+        self.release_sleeps('sleep_events',[sleep_id])
         return events_df
 
-    def get_authorization(self,user_ini):
+    @timed('decode')
+    def decode_hr(self,values):
+        '''
+        Decodes the values of a heart rate pull into an array of epoch milliseconds and an array of heart rates
+        '''
+        times=np.fromiter((h['time'] for h in values),dtype=np.int64,count=len(values))
+        hrs=np.fromiter((h['data'] for h in values),dtype=np.uint8,count=len(values))
+        return times, hrs
+
+    def hr_frame(self,times,hrs):
+        '''
+        Returns a data frame of heart rates indexed by measurement time (in UTC) from arrays of epoch milliseconds and heart rates
+        '''
+        index=pd.DatetimeIndex(pd.to_datetime(times,unit='ms'),name='time')
+        return pd.DataFrame({'hr':hrs},index=index)
+
+    def hr_urls(self,date_range,step=6):
+        '''
+        Returns the heart rate url for each [start, end] window in date_range, with step seconds between measurements
+        '''
+        athlete_id=self.whoop_id
+        return ['''{}/users/{}/metrics/heart_rate?end={}&order=t&start={}&step={}'''.format(self.api_url,
+                                                                                          athlete_id,
+                                                                                          dates[1],
+                                                                                          dates[0],
+                                                                                          step) for dates in date_range]
+
+    def iter_hr(self,date_range,checkpoint=True,step=6):
+        '''
+        Pulls heart rate for each [start, end] window in date_range, decoding each window straight into arrays,
+        and yields one data frame per window, indexed by measurement time
+        '''
+        for dates, hr_pull in zip(date_range,self.iter_api_many(self.hr_urls(date_range,step=step),checkpoint=checkpoint)):
+            hr_vals=hr_pull['values'] if hr_pull!="no response" else []
+            hr_chunk=self.hr_frame(*self.decode_hr(hr_vals))
+            if self.store is not None and step==6 and hr_pull!="no response":
+                ## the daily rollups are kept up to date as heart rate comes in, windows always hold whole days.
+                ## A window that came back without data isn't rolled up, so its days are pulled again
+                self.save_to_store('hr_daily',self.rollup_hr(hr_chunk,step=step),dates[0][:10],dates[1][:10])
+            yield hr_chunk
+
+    @timed('rollup')
+    def rollup_hr(self,hr_df,step=6):
+        '''
+        Rolls a heart rate data frame up into days (in UTC), in one vectorized pass: the lowest, average and highest
+        heart rate of each day, the number of measurements and the minutes spent in each heart rate zone.
+        The measurements must be in time order, as they are from the heart rate functions
+        '''
+        days=hr_df.index.values.astype('datetime64[D]')
+        hr=hr_df['hr'].to_numpy().astype(np.int64)
+        zone_names=['zone{}_minutes'.format(z+1) for z in range(len(self.hr_zones))]
+        if len(hr)==0:
+            return self.apply_schema('hr_daily',pd.DataFrame(columns=['day','hr_min','hr_avg','hr_max','hr_samples'] + zone_names))
+        ## the measurements of a day are next to each other, so each day is reduced between its first and last index
+        day_starts=np.flatnonzero(np.r_[True,days[1:]!=days[:-1]])
+        samples=np.diff(np.r_[day_starts,len(hr)])
+        ## zone 0 is below the first zone
+        zones=np.searchsorted(np.array(self.hr_zones)*self.max_hr,hr,side='right')
+        day_index=np.repeat(np.arange(len(day_starts)),samples)
+        zone_samples=np.bincount(day_index*(len(self.hr_zones)+1)+zones,
+                                 minlength=len(day_starts)*(len(self.hr_zones)+1)).reshape(len(day_starts),-1)
+        rollup=pd.DataFrame({'day':days[day_starts],'hr_min':np.minimum.reduceat(hr,day_starts),
+                             'hr_avg':np.add.reduceat(hr,day_starts)/samples,'hr_max':np.maximum.reduceat(hr,day_starts),
+                             'hr_samples':samples})
+        for z, zone_name in enumerate(zone_names):
+            rollup[zone_name]=zone_samples[:,z+1]*step/60.
+        return self.apply_schema('hr_daily',rollup)
+
+    def pull_hr(self,date_range,step=6):
+        '''
+        Pulls heart rate for each [start, end] window in date_range and returns one data frame indexed by measurement time
+        '''
+        hr_chunks=list(self.iter_hr(date_range,step=step))
+        if hr_chunks:
+            return self.concat(hr_chunks)
+        else:
+            return self.hr_frame(np.array([],dtype=np.int64),np.array([],dtype=np.uint8))
+
+    @timed('concat')
+    def concat(self,frames):
+        return pd.concat(frames)
+
+    def hr_legacy(self,hr_df,df=False):
+        '''
+        Converts a heart rate data frame from pull_hr into the original output - a list of [date, time, hr] lists,
+        or a data frame with date, time and hr columns if df=True
+        '''
+        ## plain arrays, so the data frame has a range index like the original rather than the measurement times
+        legacy=pd.DataFrame({'date':hr_df.index.date,'time':hr_df.index.time,'hr':hr_df['hr'].to_numpy().astype('int64')})
+        if df:
+            return legacy
+        else:
+            return legacy.values.tolist()
+
+    def apply_schema(self,dataset,data):
+        '''
+        Converts the columns of a data frame to the types in schemas for the dataset (keydata, activities, sleep or sleep_events).
+        Columns that aren't in the schema are left as they are
+        '''
+        for col, kind in self.schemas[dataset].items():
+            if col not in data.columns:
+                continue
+            if kind=='datetime':
+                data[col]=pd.to_datetime(data[col],utc=True)
+            elif kind=='day':
+                data[col]=pd.to_datetime(data[col],format='%Y-%m-%d')
+            elif kind=='category':
+                data[col]=data[col].astype('category')
+            elif kind=='int' and data[col].notna().all():
+                data[col]=pd.to_numeric(data[col],downcast='integer')
+            elif kind in ('int','float'):
+                data[col]=pd.to_numeric(data[col]).astype('float32')
+            else:
+                data[col]=pd.to_numeric(data[col]).astype('int64' if data[col].notna().all() else 'Int64')
+        return data
+
+    def pull_keydata(self,start,until):
+        '''
+        Pulls the cycles of every week from start to until and returns them cleaned into key data,
+        still holding the nested strain.workouts column the activities are built from
+        '''
+        date_range=self.week_windows(start,until)
+        cycle_urls=['{}/users/{}/cycles?end={}&start={}'.format(self.api_url,
+                                                                self.whoop_id,
+                                                                dates[1],
+                                                                dates[0]) for dates in date_range]
+        ## collecting the cycles from every week, then normalizing them in one go - there's about a cycle a day
+        return self.clean_keydata(self.normalize_records(self.iter_records(cycle_urls),expected=7*len(date_range)))
+
+    @timed('clean')
+    def clean_keydata(self,data):
+        '''
+        Cleans normalized cycles into the key data - one day per row, with sleep times in minutes and a nap duration column.
+        Without any cycles (like a timeframe before your membership), returns an empty data frame with the key data columns
+        '''
+        if len(data)==0:
+            return self.apply_schema('keydata',pd.DataFrame(columns=list(self.schemas['keydata'])+['strain.workouts']))
+        ## fixing the day column so it's not a list
+        data['days']=data['days'].str[0]
+        data.rename(columns={"days":'day'},inplace=True)
+
+        ## Putting all time into minutes instead of milliseconds
+        sleep_cols=['sleep.qualityDuration','sleep.needBreakdown.baseline','sleep.needBreakdown.debt','sleep.needBreakdown.naps',
+                    'sleep.needBreakdown.strain','sleep.needBreakdown.total']
+        data[sleep_cols]=data[sleep_cols].astype(float)/60000
+
+        ## Making nap variable - exploding the naps once, then summing the nap durations for each day
+        naps=data['sleep.naps'].explode()
+        nap_durations=pd.to_numeric(naps.str.get('qualityDuration'),errors='coerce')
+        data['nap_duration']=nap_durations.groupby(level=0).sum()/60000
+        data.drop(['sleep.naps'],axis=1,inplace=True)
+        ## the windows don't overlap, but a cycle that spans two of them can still come back twice
+        data.drop_duplicates(subset=['day','sleep.id'],inplace=True)
+        return self.apply_schema('keydata',data)
+
+    @timed('clean')
+    def clean_activities(self,data,sport_dict):
+        '''
+        Transforms the workouts in the key data into a data frame of activities, where each activity is a row.
+        If the key data has a day column, the day of each activity's cycle is kept as cycle_day
+        '''
+        workouts=data['strain.workouts']
+        has_workout=workouts.str.len()>0
+        act_data=pd.json_normalize(workouts[has_workout].str[0].tolist())
+        act_data['during.upper']=pd.to_datetime(act_data['during.upper'])
+        act_data['during.lower']=pd.to_datetime(act_data['during.lower'])
+        act_data['total_minutes']=(act_data['during.upper']-act_data['during.lower']).dt.total_seconds()/60.0
+        zones=np.array(act_data['zones'].tolist(),dtype=float).reshape(len(act_data),-1)/60000.
+        for z in range(0,6):
+            act_data['zone{}_minutes'.format(z+1)]=zones[:,z]
+        act_data['sport_name']=act_data.sportId.map(sport_dict)
+
+        act_data['day']=act_data['during.lower'].dt.strftime('%Y-%m-%d')
+        if 'day' in data:
+            ## an activity can start on a different UTC day than its cycle, the timeframes go by the cycle
+            act_data['cycle_day']=data['day'][has_workout].to_numpy()
+        act_data.drop(['zones','during.bounds'],axis=1,inplace=True)
+        act_data.drop_duplicates(inplace=True)
+        return self.apply_schema('activities',act_data)
+
+    @timed('clean')
+    def clean_sleep(self,sleep):
+        '''
+        Cleans normalized sleeps, putting all sleep times into minutes. The nested events are dropped,
+        the sleep events data is built from the sleep details instead
+        '''
+        sleep_update=['qualityDuration','latency','debtPre','debtPost','needFromStrain','sleepNeed',
+                      'habitualSleepNeed','timeInBed','lightSleepDuration','slowWaveSleepDuration',
+                      'remSleepDuration','wakeDuration','arousalTime','noDataDuration','creditFromNaps',
+                      'projectedSleep']
+        sleep[sleep_update]=sleep[sleep_update].astype(float)/60000
+        sleep.drop(['during.bounds','events'],axis=1,inplace=True)
+        return self.apply_schema('sleep',sleep)
+
+    @timed('clean')
+    def clean_sleep_events(self,events):
+        '''
+        Cleans normalized sleep events, adding the length of each event in minutes
+        '''
+        events['during.lower']=pd.to_datetime(events['during.lower'])
+        events['during.upper']=pd.to_datetime(events['during.upper'])
+        events.drop(['during.bounds'],axis=1,inplace=True)
+        events['total_minutes']=(events['during.upper']-events['during.lower']).dt.total_seconds()/60.0
+        return self.apply_schema('sleep_events',events)
+
+    def derived(self,name,source,derive=None):
+        '''
+        Returns the dataset derived from source (like the activities from all_workouts), running derive(source)
+        only if source has changed since it was last derived, so repeated calls just reuse the result.
+        Without derive, returns the cached dataset if it's still current, or None
+        '''
+        cached=self.derived_cache.get(name)
+        if cached is not None and cached[0] is source:
+            return cached[1]
+        elif derive is None:
+            return None
+        data=derive(source)
+        self.derived_cache[name]=(source,data)
+        return data
+
+    def save_to_store(self,dataset,data,start,end,complete=True):
+        '''
+        Saves a dataset to the store, if there is one, and marks the days from start to end as downloaded.
+        Days that haven't settled yet are saved but not marked, so they're pulled again the next time they're asked for.
+        With complete=False (a window of the pull came back without data), nothing is marked
+        '''
+        if self.store is not None and data is not None:
+            settled=(datetime.utcnow()-self.settle_time-timedelta(days=1)).strftime('%Y-%m-%d')
+            start=start if isinstance(start,str) else start.strftime('%Y-%m-%d')
+            end=end if isinstance(end,str) else end.strftime('%Y-%m-%d')
+            self.store.save(dataset,self.whoop_id,data,start,min(end,settled) if complete else None)
+
+    def load_from_store(self,dataset,start,end):
+        '''
+        Returns a dataset from start to end out of the store, or None if there's no store or it doesn't have the whole timeframe
+        '''
+        if self.store is not None and self.store.covers(dataset,self.whoop_id,start,end):
+            stored=self.store.load(dataset,self.whoop_id,start,end)
+            if dataset=='hr':
+                return self.hr_frame(*stored)
+            else:
+                return self.apply_schema({'cycles':'keydata','sleeps':'sleep'}.get(dataset,dataset),stored)
+
+    def get_authorization(self,user_ini,section='whoop'):
         '''
         Function to get the authorization token and user id.
-        This must be completed before a user can query the api
+        This must be completed before a user can query the api.
+        The credentials are read from the given section of the ini file, [whoop] by default
         '''
 
         config=configparser.ConfigParser()
         config.read(user_ini)
-        username=config['whoop']['username']
-        password=config['whoop']['password']
+        username=config[section]['username']
+        password=config[section]['password']
 
 
         headers={
@@ -66,7 +1283,7 @@ class whoop_login:
                 "password": password,
                 "grant_type": "password",
                 "issueRefresh": False}
-        auth = requests.post("https://api-7.whoop.com/oauth/token", json=headers)
+        auth = self.session.post(self.api_url + "/oauth/token", json=headers, timeout=self.timeout)
 
         if auth.status_code==200:
             content=auth.json()
@@ -75,6 +1292,7 @@ class whoop_login:
             start_time=content['user']['profile']['createdAt']
             self.whoop_id=user_id
             self.auth_code='bearer ' + token
+            self.session.headers['authorization']=self.auth_code
             self.start_datetime=start_time
             print("Authentication successful")
 
@@ -95,36 +1313,11 @@ class whoop_login:
                 return self.all_data
             else:
                 start_date=parser.isoparse(self.start_datetime).replace(tzinfo=None)
-                end_time='T23:59:59.999Z'
-                start_time='T00:00:00.000Z'
-                intervals=rrule.rrule(freq=WEEKLY,interval=1,until=self.current_datetime, dtstart=start_date)
-                date_range=[[d.strftime('%Y-%m-%d') + start_time,
-                            (d+relativedelta.relativedelta(weeks=1)).strftime('%Y-%m-%d') + end_time] for d in intervals]
-                all_data=pd.DataFrame()
-                for dates in date_range:
-                    cycle_url='https://api-7.whoop.com/users/{}/cycles?end={}&start={}'.format(self.whoop_id,
-                                                                                           dates[1],
-                                                                                           dates[0])
-                    data=self.pull_api(cycle_url,df=True)
-                    all_data=pd.concat([all_data,data])
-                all_data.reset_index(drop=True,inplace=True)
-
-                ## fixing the day column so it's not a list
-                all_data['days']=all_data['days'].map(lambda d: d[0])
-                all_data.rename(columns={"days":'day'},inplace=True)
-
-                ## Putting all time into minutes instead of milliseconds
-                sleep_cols=['qualityDuration','needBreakdown.baseline','needBreakdown.debt','needBreakdown.naps',
-                'needBreakdown.strain','needBreakdown.total']
-                for sleep_col in sleep_cols:
-                    all_data['sleep.' + sleep_col]=all_data['sleep.' + sleep_col].astype(float).apply(lambda x: np.nan if np.isnan(x) else x/60000)
-
-                ## Making nap variable
-                all_data['nap_duration']=all_data['sleep.naps'].apply(lambda x: x[0]['qualityDuration']/60000 if len(x)==1 else(
-                                                    sum([y['qualityDuration'] for y in x if y['qualityDuration'] is not None])/60000 if len(x)>1 else 0))
-                all_data.drop(['sleep.naps'],axis=1,inplace=True)
-                ## dropping duplicates subsetting because of list columns
-                all_data.drop_duplicates(subset=['day','sleep.id'],inplace=True)
+                missed=self.missed_pulls
+                all_data=self.pull_keydata(start_date,self.current_datetime)
+                self.all_workouts=all_data.pop('strain.workouts')
+                self.all_data_complete=self.missed_pulls==missed
+                self.save_to_store('cycles',all_data,start_date,self.current_datetime,complete=self.all_data_complete)
 
                 self.all_data=all_data
                 return all_data
@@ -140,35 +1333,30 @@ class whoop_login:
         if self.sport_dict:
             sport_dict=self.sport_dict
         else:
-            sports=self.pull_api('https://api-7.whoop.com/sports')
+            sports=self.pull_api(self.api_url + '/sports')
             sport_dict={sport['id']:sport['name'] for sport in sports}
-            self.sport_dict=self.sport_dict
+            self.sport_dict=sport_dict
 
         if self.start_datetime:
             ## process activity data
 
-            if self.all_data is not None:
-                ## use existing
-                data=self.all_data
-            else:
+            if self.all_workouts is None:
                 ## pull all data to process activities
-                data=self.get_keydata_all()
-            ## now process activities data
-            act_data=pd.json_normalize(data[data['strain.workouts'].apply(len)>0]['strain.workouts'].apply(lambda x: x[0]))
-            act_data[['during.upper','during.lower']]=act_data[['during.upper','during.lower']].apply(pd.to_datetime)
-            act_data['total_minutes']=act_data.apply(lambda x: (x['during.upper']-x['during.lower']).total_seconds()/60.0,axis=1)
-            for z in range(0,6):
-                 act_data['zone{}_minutes'.format(z+1)]=act_data['zones'].apply(lambda x: x[z]/60000.)
-            act_data['sport_name']=act_data.sportId.apply(lambda x: sport_dict[x])
-
-            act_data['day']=act_data['during.lower'].dt.strftime('%Y-%m-%d')
-            act_data.drop(['zones','during.bounds'],axis=1,inplace=True)
-            act_data.drop_duplicates(inplace=True)
+                self.all_data=None
+                self.get_keydata_all()
+            ## now process activities data, only once for each pull of the key data
+            act_data=self.derived('activities',self.all_workouts,
+                                  lambda workouts: self.save_activities(self.clean_activities(self.all_data[['day']].join(workouts),sport_dict)))
             self.all_activities=act_data
             return act_data
         else:
             print("Please run the authorization function first")
 
+    def save_activities(self,act_data):
+        self.save_to_store('activities',act_data,parser.isoparse(self.start_datetime),self.current_datetime,
+                           complete=self.all_data_complete)
+        return act_data
+
     def get_sleep_all(self):
         '''
         This function returns all sleep metrics in a data frame, for the duration of user's WHOOP membership.
@@ -182,31 +1370,10 @@ class whoop_login:
                 ## pull timeframe data
                 data=self.get_keydata_all()
 
-            ## getting all the sleep ids
-            if self.all_sleep is not None:
-                ## All sleep data already pulled
-                return self.all_sleep
-            else:
-                sleep_ids=data['sleep.id'].values.tolist()
-                sleep_list=[int(x) for x in sleep_ids if pd.isna(x)==False]
-                all_sleep=pd.DataFrame()
-                for s in sleep_list:
-                    m=self.pull_sleep_main(s)
-                    all_sleep=pd.concat([all_sleep,m])
-
-                ## Cleaning sleep data
-                sleep_update=['qualityDuration','latency','debtPre','debtPost','needFromStrain','sleepNeed',
-                              'habitualSleepNeed','timeInBed','lightSleepDuration','slowWaveSleepDuration',
-                              'remSleepDuration','wakeDuration','arousalTime','noDataDuration','creditFromNaps',
-                              'projectedSleep']
-
-                for col in sleep_update:
-                    all_sleep[col]=all_sleep[col].astype(float).apply(lambda x: np.nan if np.isnan(x) else x/60000)
-
-                all_sleep.drop(['during.bounds'],axis=1,inplace=True)
-                self.all_sleep=all_sleep.copy(deep=True)
-                all_sleep.drop(['events'],axis=1,inplace=True)
-                return all_sleep
+            ## the sleeps are only built once for each pull of the key data
+            all_sleep=self.derived('sleep',data,self.derive_sleep)
+            self.all_sleep=all_sleep
+            return all_sleep
         else:
             print("Please run the authorization function first")
 
@@ -223,76 +1390,71 @@ class whoop_login:
                 data=self.all_data
             else:
                 ## pull timeframe data
-                data=self.get_keydata_all(start,end)
+                data=self.get_keydata_all()
 
-            ## getting all the sleep ids
-            if self.all_sleep_events is not None:
-                ## All sleep data already pulled
-                return self.all_sleep_events
-            else:
-                if self.all_sleep is not None:
-                    sleep_events=self.all_sleep[['activityId','events']]
-                    all_sleep_events=pd.concat([pd.concat([pd.json_normalize(events),
-                                                            pd.DataFrame({'id':len(events)*[sleep]})],axis=1) for events, sleep in zip(sleep_events['events'],sleep_events['activityId'])])
-                else:
-                    sleep_ids=data['sleep.id'].values.tolist()
-                    sleep_list=[int(x) for x in sleep_ids if pd.isna(x)==False]
-                    all_sleep_events=pd.DataFrame()
-                    for s in sleep_list:
-                        events=self.pull_sleep_events(s)
-                        all_sleep_events=pd.concat([all_sleep_events,events])
-
-                ## Cleaning sleep events data
-                all_sleep_events['during.lower']=pd.to_datetime(all_sleep_events['during.lower'])
-                all_sleep_events['during.upper']=pd.to_datetime(all_sleep_events['during.upper'])
-                all_sleep_events.drop(['during.bounds'],axis=1,inplace=True)
-                all_sleep_events['total_minutes']=all_sleep_events.apply(lambda x: (x['during.upper']-x['during.lower']).total_seconds()/60.0,axis=1)
-
-                self.all_sleep_events=all_sleep_events
-                return all_sleep_events
+            ## the sleep events are only built once for each pull of the key data
+            all_sleep_events=self.derived('sleep_events',data,self.derive_sleep_events)
+            self.all_sleep_events=all_sleep_events
+            return all_sleep_events
         else:
             print("Please run the authorization function first")
 
-    def get_hr_all(self,df=False):
+    def derive_sleep(self,data):
+        '''
+        Pulls and cleans the sleeps of every day in a key data frame
+        '''
+        sleep_ids=data['sleep.id'].values.tolist()
+        sleep_list=[int(x) for x in sleep_ids if pd.isna(x)==False]
+        missed=self.missed_pulls
+        all_sleep=self.clean_sleep(self.normalize_records(self.iter_sleeps(sleep_list),expected=len(sleep_list)))
+        self.release_sleeps('sleep',sleep_list)
+        self.save_to_store('sleeps',all_sleep,parser.isoparse(self.start_datetime),self.current_datetime,
+                           complete=self.all_data_complete and self.missed_pulls==missed)
+        return all_sleep
+
+    def derive_sleep_events(self,data):
+        '''
+        Builds the sleep events of every day in a key data frame, reusing sleeps already pulled by get_sleep_all
+        '''
+        sleep_ids=data['sleep.id'].values.tolist()
+        sleep_list=[int(x) for x in sleep_ids if pd.isna(x)==False]
+        missed=self.missed_pulls
+        all_sleep_events=self.clean_sleep_events(self.normalize_sleep_events(self.pull_sleeps(sleep_list)))
+        self.release_sleeps('sleep_events',sleep_list)
+        self.save_to_store('sleep_events',all_sleep_events,parser.isoparse(self.start_datetime),self.current_datetime,
+                           complete=self.all_data_complete and self.missed_pulls==missed)
+        return all_sleep_events
+
+    def get_hr_all(self,df=False,columnar=False,step=6):
         '''
         This function will pull every heart rate measurement recorded for the life of WHOOP membership.
         The default return for this function is a list of lists, where each "row" contains the date, time, and hr value.
-        The measurements are spaced out every ~6 seconds on average.
+        The measurements are spaced out every ~6 seconds on average. For coarser data, set step to the number of seconds
+        between measurements, e.g. step=60 for one a minute - this pulls far less data in far fewer requests.
 
         To return a dataframe, set df=True. This will take a bit longer, but will return a data frame.
+        To return the compact data frame indexed by measurement time, set columnar=True. This is the quickest
+        and smallest option for long histories.
 
         NOTE: This api pull takes about 6 seconds per week of data ... or 1 minutes for 10 weeks of data,
         so be careful when you pull, it may take a while.
         '''
         if self.start_datetime:
-            athlete_id=self.whoop_id
             start_date=parser.isoparse(self.start_datetime).replace(tzinfo=None)
-            end_time='T23:59:59.999Z'
-            start_time='T00:00:00.000Z'
-            intervals=rrule.rrule(freq=WEEKLY,interval=1,until=self.current_datetime, dtstart=start_date)
-            date_range=[[d.strftime('%Y-%m-%d') + start_time,
-                        (d+relativedelta.relativedelta(weeks=1)).strftime('%Y-%m-%d') + end_time] for d in intervals]
-
-            hr_list=[]
-            for dates in date_range:
-                start=dates[0]
-                end=dates[1]
-                ul='''https://api-7.whoop.com/users/{}/metrics/heart_rate?end={}&order=t&start={}&step=6'''.format(athlete_id,end,start)
-                hr_vals=self.pull_api(ul)['values']
-                hr_values=[[datetime.utcfromtimestamp(h['time']/1e3).date(),
-                                  datetime.utcfromtimestamp(h['time']/1e3).time(),
-                                  h['data']] for h in hr_vals]
-                hr_list.extend(hr_values)
-            if df:
-                hr_df=pd.DataFrame(hr_list)
-                hr_df.columns=['date','time','hr']
+            date_range=self.hr_windows(start_date,self.current_datetime,step=step)
+            missed=self.missed_pulls
+            hr_df=self.pull_hr(date_range,step=step)
+            if step==6:
+                ## only the full resolution heart rate is stored
+                self.save_to_store('hr',hr_df,start_date,self.current_datetime,complete=self.missed_pulls==missed)
+            if columnar:
                 return hr_df
             else:
-                return hr_list
+                return self.hr_legacy(hr_df,df=df)
         else:
             print("Please run the authorization function first")
 
-    def get_keydata_timeframe(self,start,end=datetime.strftime(datetime.utcnow(),"%Y-%m-%d")):
+    def get_keydata_timeframe(self,start,end=None):
         '''
         This function returns a dataframe of WHOOP metrics for each day in a specified time period.
         To use this function, provide a start and end date in string format as follows "YYYY-MM-DD".
@@ -302,6 +1464,8 @@ class whoop_login:
         In the resulting dataframe, each day is a row and contains strain, recovery, and sleep information
         '''
 
+        if end is None:
+            end=self.current_datetime.strftime('%Y-%m-%d')
         st=datetime.strptime(start,'%Y-%m-%d')
         e=datetime.strptime(end,'%Y-%m-%d')
         if st>e:
@@ -311,44 +1475,20 @@ class whoop_login:
                 print("Please enter a start date that is earlier than your end date")
         else:
             if self.auth_code:
-                end_time='T23:59:59.999Z'
-                start_time='T00:00:00.000Z'
-                intervals=rrule.rrule(freq=WEEKLY,interval=1,until=e, dtstart=st)
-                date_range=[[d.strftime('%Y-%m-%d') + start_time,
-                            (d+relativedelta.relativedelta(weeks=1)).strftime('%Y-%m-%d') + end_time] for d in intervals if d<=e]
-                time_data=pd.DataFrame()
-                for dates in date_range:
-                    cycle_url='https://api-7.whoop.com/users/{}/cycles?end={}&start={}'.format(self.whoop_id,
-                                                                                           dates[1],
-                                                                                           dates[0])
-                    data=self.pull_api(cycle_url,df=True)
-                    time_data=pd.concat([time_data,data])
-                time_data.reset_index(drop=True,inplace=True)
-
-                ## fixing the day column so it's not a list
-                time_data['days']=time_data['days'].map(lambda d: d[0])
-                time_data.rename(columns={"days":'day'},inplace=True)
-
-                ## Putting all time into minutes instead of milliseconds
-                sleep_cols=['qualityDuration','needBreakdown.baseline','needBreakdown.debt','needBreakdown.naps',
-                'needBreakdown.strain','needBreakdown.total']
-                for sleep_col in sleep_cols:
-                    time_data['sleep.' + sleep_col]=time_data['sleep.' + sleep_col].astype(float).apply(lambda x: np.nan if np.isnan(x) else x/60000)
-
-                ## Making nap variable
-                time_data['nap_duration']=time_data['sleep.naps'].apply(lambda x: x[0]['qualityDuration']/60000 if len(x)==1 else(
-                                                    sum([y['qualityDuration'] for y in x if y['qualityDuration'] is not None])/60000 if len(x)>1 else 0))
-                time_data.drop(['sleep.naps'],axis=1,inplace=True)
-
-                ## removing duplicates
-                time_data.drop_duplicates(subset=['day','sleep.id'],inplace=True)
+                stored=self.load_from_store('cycles',start,end)
+                if stored is not None:
+                    return stored
 
+                missed=self.missed_pulls
+                time_data=self.pull_keydata(st,e)
+                time_data.drop(['strain.workouts'],axis=1,inplace=True)
+                self.save_to_store('cycles',time_data,start,end,complete=self.missed_pulls==missed)
 
                 return time_data
             else:
                 print("Please run the authorization function first")
 
-    def get_activities_timeframe(self,start,end=datetime.strftime(datetime.utcnow(),"%Y-%m-%d")):
+    def get_activities_timeframe(self,start,end=None):
         '''
         Activity data is pulled through the get_keydata functions so if the data pull is present, this function
         just transforms the activity column into a dataframe of activities, where each activity is a row.
@@ -357,6 +1497,8 @@ class whoop_login:
         If no end date is specified, it will default to today's date.
         '''
 
+        if end is None:
+            end=self.current_datetime.strftime('%Y-%m-%d')
         st=datetime.strptime(start,'%Y-%m-%d')
         e=datetime.strptime(end,'%Y-%m-%d')
         if st>e:
@@ -367,40 +1509,39 @@ class whoop_login:
         else:
 
             if self.auth_code:
+                stored=self.load_from_store('activities',start,end)
+                if stored is not None:
+                    return stored
 
                 if self.sport_dict:
                     sport_dict=self.sport_dict
                 else:
-                    sports=self.pull_api('https://api-7.whoop.com/sports')
+                    sports=self.pull_api(self.api_url + '/sports')
                     sport_dict={sport['id']:sport['name'] for sport in sports}
-                    self.sport_dict=self.sport_dict
+                    self.sport_dict=sport_dict
 
                 ## process activity data
-                if self.all_data is not None:
-                    ## use existing
+                if self.all_workouts is not None:
+                    ## use existing - the activities of all the days are derived once, then sliced
                     data=self.all_data
-                    data=data[(data.day>=start)&(data.day<=end)].copy(deep=True)
+                    all_activities=self.derived('activities',self.all_workouts,
+                                                lambda workouts: self.save_activities(self.clean_activities(self.all_data[['day']].join(workouts),sport_dict)))
+                    workouts=self.all_workouts[(data.day>=start)&(data.day<=end)]
+                    workout_ids=workouts[workouts.str.len()>0].str[0].str.get('id')
+                    return all_activities[all_activities.id.isin(workout_ids)]
                 else:
                     ## pull timeframe data
-                    data=self.get_keydata_timeframe(start,end)
+                    missed=self.missed_pulls
+                    workouts=self.pull_keydata(st,e)[['day','strain.workouts']]
                 ## now process activities data
-                act_data=pd.json_normalize(data[data['strain.workouts'].apply(len)>0]['strain.workouts'].apply(lambda x: x[0]))
-                act_data[['during.upper','during.lower']]=act_data[['during.upper','during.lower']].apply(pd.to_datetime)
-                act_data['total_minutes']=act_data.apply(lambda x: (x['during.upper']-x['during.lower']).total_seconds()/60.0,axis=1)
-                for z in range(0,6):
-                     act_data['zone{}_minutes'.format(z+1)]=act_data['zones'].apply(lambda x: x[z]/60000.)
-                act_data['sport_name']=act_data.sportId.apply(lambda x: sport_dict[x])
-
-                act_data['day']=act_data['during.lower'].dt.strftime('%Y-%m-%d')
-                act_data.drop(['zones','during.bounds'],axis=1,inplace=True)
-                act_data.drop_duplicates(inplace=True)
-                self.all_activities=act_data
+                act_data=self.clean_activities(workouts,sport_dict)
+                self.save_to_store('activities',act_data,start,end,complete=self.missed_pulls==missed)
                 return act_data
             else:
                 print("Please run the authorization function first")
 
 
-    def get_sleep_timeframe(self,start,end=datetime.strftime(datetime.utcnow(),"%Y-%m-%d")):
+    def get_sleep_timeframe(self,start,end=None):
         '''
         This function returns sleep metrics in a data frame, for timeframe specified by the user.
         Each row in the data frame represents one night of sleep.
@@ -410,6 +1551,8 @@ class whoop_login:
         All sleep times are returned in minutes.
         '''
 
+        if end is None:
+            end=self.current_datetime.strftime('%Y-%m-%d')
         st=datetime.strptime(start,'%Y-%m-%d')
         e=datetime.strptime(end,'%Y-%m-%d')
         if st>e:
@@ -419,45 +1562,42 @@ class whoop_login:
                 print("Please enter a start date that is earlier than your end date")
         else:
             if self.auth_code:
+                stored=self.load_from_store('sleeps',start,end)
+                if stored is not None:
+                    return stored
+
+                missed=self.missed_pulls
                 if self.all_data is not None:
                     ## use existing
                     data=self.all_data
                     data=data[(data.day>=start)&(data.day<=end)].copy(deep=True)
+                    complete=self.all_data_complete
                 else:
                     ## pull timeframe data
                     data=self.get_keydata_timeframe(start,end)
+                    complete=True
 
                 ## getting all the sleep ids
                 sleep_ids=data['sleep.id'].values.tolist()
                 sleep_list=[int(x) for x in sleep_ids if pd.isna(x)==False]
-                if self.all_sleep is not None:
+                all_sleep=self.derived('sleep',self.all_data)
+                if all_sleep is not None:
                     ## All sleep data already pulled so just filter
-                    all_sleep=self.all_sleep
                     time_sleep=all_sleep[all_sleep.activityId.isin(sleep_list)]
                     return time_sleep
 
                 else:
-                    time_sleep=pd.DataFrame()
-                    for s in sleep_list:
-                        m=self.pull_sleep_main(s)
-                        time_sleep=pd.concat([time_sleep,m])
-
-                    ## Cleaning sleep data
-                    sleep_update=['qualityDuration','latency','debtPre','debtPost','needFromStrain','sleepNeed',
-                                  'habitualSleepNeed','timeInBed','lightSleepDuration','slowWaveSleepDuration',
-                                  'remSleepDuration','wakeDuration','arousalTime','noDataDuration','creditFromNaps',
-                                  'projectedSleep']
+                    time_sleep=self.normalize_records(self.iter_sleeps(sleep_list),expected=len(sleep_list))
 
-                    for col in sleep_update:
-                        time_sleep[col]=time_sleep[col].astype(float).apply(lambda x: np.nan if np.isnan(x) else x/60000)
-
-                    time_sleep.drop(['during.bounds','events'],axis=1,inplace=True)
+                    time_sleep=self.clean_sleep(time_sleep)
+                    self.release_sleeps('sleep',sleep_list)
+                    self.save_to_store('sleeps',time_sleep,start,end,complete=complete and self.missed_pulls==missed)
 
                     return time_sleep
             else:
                 print("Please run the authorization function first")
 
-    def get_sleep_events_timeframe(self,start,end=datetime.strftime(datetime.utcnow(),"%Y-%m-%d")):
+    def get_sleep_events_timeframe(self,start,end=None):
         '''
         This function returns sleep events in a data frame, for the time frame specified by the user.
         Each row in the data frame represents an individual sleep event within an individual night of sleep.
@@ -466,6 +1606,8 @@ class whoop_login:
         If no end date is specified, it will default to today's date.
         '''
 
+        if end is None:
+            end=self.current_datetime.strftime('%Y-%m-%d')
         st=datetime.strptime(start,'%Y-%m-%d')
         e=datetime.strptime(end,'%Y-%m-%d')
         if st>e:
@@ -476,52 +1618,52 @@ class whoop_login:
         else:
 
             if self.auth_code:
+                stored=self.load_from_store('sleep_events',start,end)
+                if stored is not None:
+                    return stored
+
+                missed=self.missed_pulls
                 if self.all_data is not None:
                     ## use existing
                     data=self.all_data
                     data=data[(data.day>=start)&(data.day<=end)].copy(deep=True)
+                    complete=self.all_data_complete
                 else:
                     ## pull timeframe data
                     data=self.get_keydata_timeframe(start,end)
+                    complete=True
 
                 ## getting all the sleep ids
                 sleep_ids=data['sleep.id'].values.tolist()
                 sleep_list=[int(x) for x in sleep_ids if pd.isna(x)==False]
-                if self.all_sleep_events is not None:
+                all_sleep_events=self.derived('sleep_events',self.all_data)
+                if all_sleep_events is not None:
                     ## All sleep data already pulled so just filter
-                    all_sleep_events=self.all_sleep_events
                     time_sleep_events=all_sleep_events[all_sleep_events.id.isin(sleep_list)]
                     return time_sleep_events
 
                 else:
-                    if self.all_sleep is not None:
-                        sleep_events=self.all_sleep[['activityId','events']]
-                        time_sleep=sleep_events[sleep_events.id.isin(sleep_list)]
-                        time_sleep_events=pd.concat([pd.concat([pd.json_normalize(events),
-                                                                pd.DataFrame({'id':len(events)*[sleep]})],axis=1) for events, sleep in zip(time_sleep['events'],time_sleep['activityId'])])
-                    else:
-                        time_sleep_events=pd.DataFrame()
-                        for s in sleep_list:
-                            events=self.pull_sleep_events(s)
-                            time_sleep_events=pd.concat([time_sleep_events,events])
-
-                    ## Cleaning sleep events data
-                    time_sleep_events['during.lower']=pd.to_datetime(time_sleep_events['during.lower'])
-                    time_sleep_events['during.upper']=pd.to_datetime(time_sleep_events['during.upper'])
-                    time_sleep_events.drop(['during.bounds'],axis=1,inplace=True)
-                    time_sleep_events['total_minutes']=time_sleep_events.apply(lambda x: (x['during.upper']-x['during.lower']).total_seconds()/60.0,axis=1)
+                    ## sleeps already pulled by the sleep functions are reused rather than pulled again
+                    time_sleep_events=self.normalize_sleep_events(self.pull_sleeps(sleep_list))
+
+                    time_sleep_events=self.clean_sleep_events(time_sleep_events)
+                    self.release_sleeps('sleep_events',sleep_list)
+                    self.save_to_store('sleep_events',time_sleep_events,start,end,complete=complete and self.missed_pulls==missed)
 
                     return time_sleep_events
             else:
                 print("Please run the authorization function first")
 
-    def get_hr_timeframe(self,start,end=datetime.strftime(datetime.utcnow(),"%Y-%m-%d"),df=False):
+    def get_hr_timeframe(self,start,end=None,df=False,columnar=False,step=6):
         '''
         This function will pull every heart rate measurement recorded, for the time frame specified by the user.
         The default return for this function is a list of lists, where each "row" contains the date, time, and hr value.
-        The measurements are spaced out every ~6 seconds on average.
+        The measurements are spaced out every ~6 seconds on average. For coarser data, set step to the number of seconds
+        between measurements, e.g. step=60 for one a minute - this pulls far less data in far fewer requests.
 
         To return a dataframe, set df=True. This will take a bit longer, but will return a data frame.
+        To return the compact data frame indexed by measurement time, set columnar=True. This is the quickest
+        and smallest option for long timeframes.
 
         If no end date is specified, it will default to today's date.
 
@@ -529,6 +1671,8 @@ class whoop_login:
         so be careful when you pull, it may take a while.
         '''
 
+        if end is None:
+            end=self.current_datetime.strftime('%Y-%m-%d')
         st=datetime.strptime(start,'%Y-%m-%d')
         e=datetime.strptime(end,'%Y-%m-%d')
         if st>e:
@@ -539,30 +1683,334 @@ class whoop_login:
         else:
 
             if self.start_datetime:
-                athlete_id=self.whoop_id
-                start_date=parser.isoparse(self.start_datetime).replace(tzinfo=None)
-                end_time='T23:59:59.999Z'
-                start_time='T00:00:00.000Z'
-                ## using the st and e since it needs the datetime formatted date
-                intervals=rrule.rrule(freq=WEEKLY,interval=1,until=e, dtstart=st)
-                date_range=[[d.strftime('%Y-%m-%d') + start_time,
-                            (d+relativedelta.relativedelta(weeks=1)).strftime('%Y-%m-%d') + end_time] for d in intervals]
-
-                hr_list=[]
-                for dates in date_range:
-                    start=dates[0]
-                    end=dates[1]
-                    ul='''https://api-7.whoop.com/users/{}/metrics/heart_rate?end={}&order=t&start={}&step=6'''.format(athlete_id,end,start)
-                    hr_vals=self.pull_api(ul)['values']
-                    hr_values=[[datetime.utcfromtimestamp(h['time']/1e3).date(),
-                                      datetime.utcfromtimestamp(h['time']/1e3).time(),
-                                      h['data']] for h in hr_vals]
-                    hr_list.extend(hr_values)
-                if df:
-                    hr_df=pd.DataFrame(hr_list)
-                    hr_df.columns=['date','time','hr']
+                ## only the full resolution heart rate is stored
+                hr_df=self.load_from_store('hr',start,end) if step==6 else None
+                if hr_df is None:
+                    ## using the st and e since it needs the datetime formatted date
+                    date_range=self.hr_windows(st,e,step=step)
+                    missed=self.missed_pulls
+                    hr_df=self.pull_hr(date_range,step=step)
+                    if step==6:
+                        self.save_to_store('hr',hr_df,start,end,complete=self.missed_pulls==missed)
+                if columnar:
                     return hr_df
                 else:
-                    return hr_list
+                    return self.hr_legacy(hr_df,df=df)
             else:
                 print("Please run the authorization function first")
+
+    def get_daily_rollups(self,start=None,end=None):
+        '''
+        This function returns one row per day with your strain, recovery and sleep scores from the key data, and your
+        lowest, average and highest heart rate and minutes in each heart rate zone, rolled up from the heart rate data.
+
+        With a store, the heart rate rollups are saved as heart rate is pulled, and only the days that aren't in
+        the store yet are pulled, so once they're there, a rollup only reads a few kilobytes.
+
+        If no start date is specified, it will start from the beginning of your membership.
+        If no end date is specified, it will default to today's date.
+        '''
+        if self.start_datetime:
+            st=datetime.strptime(start,'%Y-%m-%d') if start else parser.isoparse(self.start_datetime).replace(tzinfo=None)
+            e=datetime.strptime(end,'%Y-%m-%d') if end else self.current_datetime
+            if st>e:
+                print("Please enter a start date that is earlier than your end date")
+                return
+            start=st.strftime('%Y-%m-%d')
+            end=e.strftime('%Y-%m-%d')
+            if self.store is not None:
+                for gap_start, gap_end in self.store.missing('hr_daily',self.whoop_id,start,end):
+                    ## pulling the heart rate saves its rollups, so the chunks themselves aren't needed
+                    gap=self.hr_windows(datetime.strptime(gap_start,'%Y-%m-%d'),datetime.strptime(gap_end,'%Y-%m-%d'))
+                    for hr_chunk in self.iter_hr(gap,checkpoint=False):
+                        pass
+                hr_daily=self.apply_schema('hr_daily',self.store.load('hr_daily',self.whoop_id,start,end))
+            else:
+                rollups=[self.rollup_hr(hr_chunk) for hr_chunk in self.iter_hr(self.hr_windows(st,e),checkpoint=False)]
+                ## a timeframe before your membership has no windows, so it's rolled up from no heart rate at all
+                hr_daily=self.concat(rollups) if rollups else self.rollup_hr(self.hr_frame(np.array([],dtype=np.int64),
+                                                                                          np.array([],dtype=np.uint8)))
+            keydata=self.get_keydata_timeframe(start,end)
+            daily=keydata[['day'] + self.rollup_keydata].merge(hr_daily,on='day',how='outer')
+            return daily.sort_values('day').reset_index(drop=True)
+        else:
+            print("Please run the authorization function first")
+
+    def get_weekly_rollups(self,start=None,end=None):
+        '''
+        This function rolls the daily rollups up into weeks, starting on Mondays - average strain, recovery and sleep scores,
+        the lowest, average and highest heart rate and the total minutes in each heart rate zone, along with the number of days
+        '''
+        daily=self.get_daily_rollups(start,end)
+        if daily is not None:
+            week=(daily['day']-pd.to_timedelta(daily['day'].dt.weekday,unit='D')).rename('week')
+            weekly=daily.groupby(week).agg({col:'mean' if how=='weighted' else how for col, how in self.weekly_rollup.items()})
+            samples=daily['hr_samples'].astype(float)
+            weekly['hr_avg']=(daily['hr_avg']*samples).groupby(week).sum(min_count=1)/samples.groupby(week).sum().replace(0,np.nan)
+            weekly.insert(0,'days',daily.groupby(week)['day'].count())
+            return weekly.reset_index()
+
+    def sync_paths(self,sync_dir):
+        '''
+        Returns the folder where this user's synced data is stored, along with the path of its sync state file
+        '''
+        user_dir=os.path.join(sync_dir,str(self.whoop_id))
+        os.makedirs(user_dir,exist_ok=True)
+        return user_dir, os.path.join(user_dir,'state.json')
+
+    def read_sync_state(self,sync_dir):
+        '''
+        Returns the sync state (last synced day and heart rate time) stored for this user, or an empty state
+        '''
+        user_dir,state_path=self.sync_paths(sync_dir)
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                return json.load(f)
+        else:
+            return {}
+
+    def write_sync_state(self,sync_dir,state):
+        user_dir,state_path=self.sync_paths(sync_dir)
+        with open(state_path + '.tmp','w') as f:
+            json.dump(state,f)
+        os.replace(state_path + '.tmp',state_path)
+
+    def sync_keydata(self,sync_dir='whoop_sync',overlap=timedelta(days=2)):
+        '''
+        This function keeps an up to date copy of your key data in sync_dir and returns all of it.
+        The first sync pulls your whole membership. Later syncs only pull from the last synced day
+        (minus the overlap, to pick up data that arrived late) and merge it into the stored data,
+        so a daily sync only needs a request or two. The synced data is also stored in all_data, and the number
+        of rows this sync pulled in sync_rows['keydata'].
+        '''
+
+        if self.start_datetime:
+            user_dir,state_path=self.sync_paths(sync_dir)
+            data_path=os.path.join(user_dir,'keydata.pkl')
+            state=self.read_sync_state(sync_dir)
+
+            missed=self.missed_pulls
+            if state.get('keydata_day') and os.path.exists(data_path):
+                stored=pd.read_pickle(data_path)
+                start=min(datetime.strptime(state['keydata_day'],'%Y-%m-%d')-overlap,self.current_datetime)
+                new_data=self.get_keydata_timeframe(start.strftime('%Y-%m-%d'),self.current_datetime.strftime('%Y-%m-%d'))
+                all_data=self.concat([stored.drop(['strain.workouts'],axis=1,errors='ignore'),new_data])
+            else:
+                new_data=all_data=self.get_keydata_all()
+            self.sync_rows['keydata']=len(new_data)
+            ## newer pulls replace the stored rows for the same day
+            all_data=all_data.drop_duplicates(subset=['day'],keep='last')
+            all_data=self.apply_schema('keydata',all_data.sort_values('day').reset_index(drop=True))
+
+            all_data.to_pickle(data_path + '.tmp')
+            os.replace(data_path + '.tmp',data_path)
+            state['keydata_day']=all_data['day'].max().strftime('%Y-%m-%d')
+            self.write_sync_state(sync_dir,state)
+            self.all_data=all_data
+            self.all_data_complete=self.missed_pulls==missed
+            ## the synced key data doesn't keep the workouts, they're pulled again for the activities
+            self.all_workouts=None
+            return all_data
+        else:
+            print("Please run the authorization function first")
+
+    def sync_hr(self,sync_dir='whoop_sync',overlap=timedelta(hours=6)):
+        '''
+        This function keeps an up to date copy of your heart rate data in sync_dir and returns all of it
+        as a data frame indexed by measurement time.
+        The first sync pulls your whole membership. Later syncs only pull from the last synced measurement
+        (minus the overlap, to pick up data that arrived late) and merge it into the stored data.
+        The number of measurements this sync pulled is kept in sync_rows['hr'].
+        '''
+
+        if self.start_datetime:
+            user_dir,state_path=self.sync_paths(sync_dir)
+            data_path=os.path.join(user_dir,'hr.pkl')
+            state=self.read_sync_state(sync_dir)
+
+            if state.get('hr_time') and os.path.exists(data_path):
+                stored=pd.read_pickle(data_path)
+                start=min(datetime.strptime(state['hr_time'],'%Y-%m-%d %H:%M:%S')-overlap,self.current_datetime)
+                new_hr=self.get_hr_timeframe(start.strftime('%Y-%m-%d'),self.current_datetime.strftime('%Y-%m-%d'),columnar=True)
+                hr_df=self.concat([stored,new_hr])
+            else:
+                new_hr=hr_df=self.get_hr_all(columnar=True)
+            self.sync_rows['hr']=len(new_hr)
+            ## newer pulls replace the stored measurements for the same time
+            hr_df=hr_df[~hr_df.index.duplicated(keep='last')].sort_index()
+
+            hr_df.to_pickle(data_path + '.tmp')
+            os.replace(data_path + '.tmp',data_path)
+            if len(hr_df)>0:
+                state['hr_time']=hr_df.index[-1].strftime('%Y-%m-%d %H:%M:%S')
+                self.write_sync_state(sync_dir,state)
+            return hr_df
+        else:
+            print("Please run the authorization function first")
+
+    def hr_chunk_windows(self,start=None,end=None,step=6):
+        '''
+        Returns the heart rate windows between start and end for the streaming heart rate functions,
+        defaulting to the beginning of your membership and today
+        '''
+        if self.start_datetime:
+            st=datetime.strptime(start,'%Y-%m-%d') if start else parser.isoparse(self.start_datetime).replace(tzinfo=None)
+            e=datetime.strptime(end,'%Y-%m-%d') if end else self.current_datetime
+            if st>e:
+                print("Please enter a start date that is earlier than your end date")
+            else:
+                return self.hr_windows(st,e,step=step)
+        else:
+            print("Please run the authorization function first")
+        return []
+
+    def get_hr_chunks(self,start=None,end=None,step=6):
+        '''
+        This function yields your heart rate data one window at a time (a week at the default 6 second step),
+        as compact data frames indexed by measurement time, so only about one window of measurements is held
+        in memory however long the timeframe is.
+
+        If no start date is specified, it will start from the beginning of your membership.
+        If no end date is specified, it will default to today's date.
+        '''
+
+        ## chunks aren't checkpointed, so memory stays bounded to the weeks in flight
+        for hr_chunk in self.iter_hr(self.hr_chunk_windows(start,end,step=step),checkpoint=False,step=step):
+            yield hr_chunk
+
+    def export_hr(self,path,start=None,end=None,format='parquet',step=6):
+        '''
+        This function writes your heart rate data to disk one window at a time (a week at the default 6 second step),
+        without holding the full history in memory, and returns the number of measurements written.
+
+        With format='parquet', path is a folder and each window is written to its own partition, named after the step
+        and the first day of the window (path/step=6/window=YYYY-MM-DD/hr.parquet), so exports at different steps never mix.
+        This needs pyarrow (in requirements.txt) or fastparquet - without either, an ImportError is raised before anything is pulled. Windows that have closed and are already in the folder aren't pulled again,
+        so an interrupted export resumes where it stopped. With format='csv' or format='jsonl', every window is appended to the file at path
+        (one json object per measurement with jsonl).
+
+        If no start date is specified, it will start from the beginning of your membership.
+        If no end date is specified, it will default to today's date.
+        '''
+
+        if format not in ('parquet','csv','jsonl'):
+            print("Please choose a format of either parquet, csv or jsonl")
+            return
+        check_format(format)
+        date_range=self.hr_chunk_windows(start,end,step=step)
+        if format=='parquet':
+            window_files={dates[0]:os.path.join(path,'step={}'.format(step),'window={}'.format(dates[0][:10]),'hr.parquet')
+                          for dates in date_range}
+            date_range=[dates for dates, url in zip(date_range,self.hr_urls(date_range,step=step))
+                        if not (os.path.exists(window_files[dates[0]]) and self.window_closed(url))]
+        rows=0
+        for dates, hr_chunk in zip(date_range,self.iter_hr(date_range,checkpoint=False,step=step)):
+            if format=='parquet':
+                window_file=window_files[dates[0]]
+                os.makedirs(os.path.dirname(window_file),exist_ok=True)
+                ## writing to a temporary file first, so an interrupted write isn't mistaken for a finished window
+                hr_chunk.to_parquet(window_file + '.tmp')
+                os.replace(window_file + '.tmp',window_file)
+            elif len(hr_chunk)>0 and format=='csv':
+                hr_chunk.to_csv(path,mode='w' if rows==0 else 'a',header=rows==0)
+            elif len(hr_chunk)>0:
+                lines=hr_chunk.reset_index().to_json(orient='records',lines=True,date_format='iso')
+                with open(path,'w' if rows==0 else 'a') as f:
+                    ## older pandas versions leave off the last newline, which would join the windows' lines
+                    f.write(lines if lines.endswith('\n') else lines + '\n')
+            rows+=len(hr_chunk)
+        return rows
+
+
+class whoop_team:
+    '''Downloads the data of many WHOOP accounts at once. Every account gets its own whoop_login, and all of them
+        share one throttle, so at most max_workers requests are in flight across the whole team (and no more than
+        rate requests are started per second, if rate is set), with free slots shared fairly between the accounts'''
+
+    def __init__(self, user_ini, sections=None, max_workers=8, rate=None, cache=None, store=None, **login_kwargs):
+        ## user_ini is either one ini file with a section per account, or a list of ini files with a [whoop] section each
+        if isinstance(user_ini,str):
+            config=configparser.ConfigParser()
+            config.read(user_ini)
+            if sections is None:
+                sections=[s for s in config.sections() if 'username' in config[s]]
+            self.accounts={section:(user_ini,section) for section in sections}
+        else:
+            self.accounts={os.path.splitext(os.path.basename(ini))[0]:(ini,'whoop') for ini in user_ini}
+        self.max_workers=max_workers
+        self.throttle=whoop_throttle(max(1,max_workers or 1),rate=rate)
+        ## file backed caches and stores are opened once, so the accounts don't compete for the same file
+        cache=whoop_cache(cache) if isinstance(cache,str) else cache
+        store=whoop_store(store) if isinstance(store,str) else store
+        self.logins={name:whoop_login(max_workers=max_workers,cache=cache,store=store,throttle=self.throttle,**login_kwargs)
+                     for name in self.accounts}
+
+    def get_authorization(self):
+        '''
+        Authenticates every account at once and returns the names of the accounts that authenticated
+        '''
+        with ThreadPoolExecutor(max_workers=max(1,len(self.logins))) as pool:
+            list(pool.map(lambda name: self.logins[name].get_authorization(*self.accounts[name]),self.logins))
+        return [name for name, login in self.logins.items() if login.auth_code]
+
+    def close(self):
+        '''
+        Closes every account's login, shutting down their process pools and connections
+        '''
+        for login in self.logins.values():
+            login.close()
+
+    def export_account(self,name,out_dir,datasets,start,end,format):
+        login=self.logins[name]
+        account_dir=os.path.join(out_dir,name)
+        os.makedirs(account_dir,exist_ok=True)
+        rows={}
+        for dataset in datasets:
+            if dataset=='hr':
+                hr_path=os.path.join(account_dir,'hr' if format=='parquet' else 'hr.' + format)
+                rows[dataset]=login.export_hr(hr_path,start=start,end=end,format=format)
+            else:
+                if start is None and end is None:
+                    data=getattr(login,'get_{}_all'.format(dataset))()
+                else:
+                    ## without a start, the timeframe starts with the membership
+                    first=start or parser.isoparse(login.start_datetime).strftime('%Y-%m-%d')
+                    data=getattr(login,'get_{}_timeframe'.format(dataset))(first,end)
+                if data is None:
+                    ## the timeframe was rejected, the reason has already been printed
+                    print("Skipped {} for {}".format(dataset,name))
+                    rows[dataset]=None
+                    continue
+                write_frame(data,os.path.join(account_dir,dataset + EXTENSIONS[format]),format)
+                rows[dataset]=len(data)
+        return rows
+
+    def export(self,out_dir,datasets=('keydata','activities','sleep','sleep_events','hr'),start=None,end=None,format='parquet'):
+        '''
+        Exports the data of every authenticated account to its own folder (out_dir/<account>), pulling all the
+        accounts at once. Every dataset is written in the given format (parquet, csv or jsonl) - key data, activities,
+        sleep and sleep events as one file each, and heart rate with export_hr. Returns the number of rows written
+        for each account and dataset, or None for a dataset that was skipped because its timeframe was rejected.
+
+        If no start date is specified, it will start from the beginning of each membership.
+        If no end date is specified, it will default to today's date.
+        An account whose pulls are rejected or still fail after retrying is reported and skipped, the other accounts carry on
+        '''
+        names=[name for name, login in self.logins.items() if login.auth_code]
+        if len(names)==0:
+            print("Please run the authorization function first")
+            return
+        if format not in EXTENSIONS:
+            print("Please choose a format of either parquet, csv or jsonl")
+            return
+        check_format(format)
+        results={}
+        with ThreadPoolExecutor(max_workers=len(names)) as pool:
+            futures={name:pool.submit(self.export_account,name,out_dir,datasets,start,end,format) for name in names}
+            for name, future in futures.items():
+                try:
+                    results[name]=future.result()
+                except whoop_api_error as e:
+                    print("Export failed for {}: {}".format(name,e))
+                    results[name]=None
+        return results